@@ -9,49 +9,272 @@ potential account names for different naming schemes.
 
 The lists can be used for brute-forcing valid user names
 or password spraying.
+
+Custom naming schemes can be given as templates, e.g. '{first}_{l}'
+or '{last}{f}{f2}'. The placeholders {first} and {last} stand for the
+full name parts, {f} and {l} for their first letter and {fN} and {lN}
+for their first N letters.
 """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import gzip
+import hashlib
 import itertools
+import json
+import math
+import re
+import string
+import unicodedata
+
+
+BUFFER_SIZE = 1 << 20
+BLOOM_ERROR_RATE = 1e-5
+BLOOM_MAX_HASHES = 6
+DEFAULT_CAPACITY = 10000000
+TRANSLITERATIONS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss", "æ": "ae", "ø": "oe", "å": "aa"})
+
+
+def first_last(name):
+    return '.'.join(name)
+
+
+def flast(name):
+    if len(name) > 1:
+        return name[0][0] + name[-1]
+    return name[0]
+
+
+def f_last(name):
+    if len(name) > 1:
+        return name[0][0] + '.' + name[-1]
+    return name[0]
+
+
+SCHEMES = {
+    "first.last.txt": first_last,
+    "flast.txt": flast,
+    "f.last.txt": f_last,
+}
+
+
+def compile_template(template):
+    """
+    Compile a naming scheme template into a function formatting a name.
+    Names consisting of a single part are returned unchanged.
+    """
+    fmt = []
+    slices = []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        fmt.append(literal.replace('{', '{{').replace('}', '}}'))
+        if field is None:
+            continue
+        match = re.fullmatch(r'(first|last)|([fl])(\d*)', field)
+        if not match or spec or conversion:
+            raise ValueError(f"Invalid placeholder '{{{field}}}' in template '{template}'")
+        if match.group(1):
+            slices.append((0 if field == "first" else -1, slice(None)))
+        else:
+            slices.append((0 if match.group(2) == "f" else -1, slice(int(match.group(3) or 1))))
+        fmt.append('{}')
+    fmt = ''.join(fmt)
+
+    def scheme(name):
+        if len(name) == 1:
+            return name[0]
+        return fmt.format(*(name[i][s] for i, s in slices))
+    return scheme
+
+
+def template_filename(template):
+    """
+    Derive an output file name from a template.
+    """
+    return re.sub(r'[{}/]', '', template) + ".txt"
+
+
+@functools.lru_cache(maxsize=None)
+def transliterate(part):
+    """
+    Transliterate umlauts (e.g. ä to ae) and strip accents from a name part.
+    """
+    decomposed = unicodedata.normalize('NFKD', part.translate(TRANSLITERATIONS))
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+class BloomFilter:
+    """
+    Probabilistic set with bounded memory for detecting duplicates.
+    False positives occur at the configured error rate, false negatives never.
+    """
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        # fewer hash functions than optimal trade a bit of memory for speed
+        self.hashes = min(BLOOM_MAX_HASHES, max(1, round(-math.log2(error_rate))))
+        self.size = max(8, int(-self.hashes * capacity / math.log(1 - error_rate ** (1 / self.hashes))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, item):
+        """
+        Add an item and return whether it was (probably) already contained.
+        """
+        digest = int.from_bytes(hashlib.blake2b(item.encode(), digest_size=16).digest(), 'little')
+        pos = (digest >> 64) % self.size
+        step = (digest & 0xffffffffffffffff) % self.size | 1
+        bits = self.bits
+        contained = True
+        for _ in range(self.hashes):
+            byte = bits[pos >> 3]
+            mask = 1 << (pos & 7)
+            if not byte & mask:
+                bits[pos >> 3] = byte | mask
+                contained = False
+            pos = (pos + step) % self.size
+        return contained
+
 
+def read_names(filename, translit=False):
+    """
+    Yield the lower-cased, non-empty lines of a file.
+    """
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip() != "":
+                name = line.lower().strip()
+                yield ' '.join(map(transliterate, name.split())) if translit else name
 
-def main(names_files):
-    names = None
+
+def iter_names(names_files, translit=False):
+    """
+    Yield the names as tuples of name parts without materializing all combinations.
+    """
     if len(names_files) == 1:
         # file with combined 'Firstname Lastname' entries
-        with open(names_files[0], 'r', encoding='utf-8') as f:
-            names = [n.lower().split() for n in f.readlines() if n.strip() != ""]
+        for n in read_names(names_files[0], translit):
+            yield tuple(n.split())
     else:
         # separate files with 'Firstname' and 'Lastname'
-        with open(names_files[0], 'r', encoding='utf-8') as f:
-            firstnames = [n.lower().strip() for n in f.readlines() if n.strip() != ""]
-        with open(names_files[1], 'r', encoding='utf-8') as f:
-            lastnames = [n.lower().strip() for n in f.readlines() if n.strip() != ""]
-        names = list(itertools.product(firstnames, lastnames))
+        firstnames = list(read_names(names_files[0], translit))
+        lastnames = list(read_names(names_files[1], translit))
+        yield from itertools.product(firstnames, lastnames)
 
-    with open("first.last.txt", 'w', encoding='utf-8') as f:
-        for name in names:
-            f.write('.'.join(name) + '\n')
 
-    with open("flast.txt", 'w', encoding='utf-8') as f:
-        for name in names:
-            if len(name) > 1:
-                f.write(name[0][0] + name[-1] + '\n')
-            else:
-                f.write(name[0] + '\n')
+def iter_product_range(firstnames, lastnames, start, end):
+    """
+    Yield the entries start to end (exclusive) of the cartesian product of first and last names.
+    """
+    i = start
+    while i < end:
+        row, col = divmod(i, len(lastnames))
+        stop = min(col + end - i, len(lastnames))
+        first = firstnames[row]
+        for last in lastnames[col:stop]:
+            yield first, last
+        i += stop - col
 
-    with open("f.last.txt", 'w', encoding='utf-8') as f:
-        for name in names:
-            if len(name) > 1:
-                f.write(name[0][0] + '.' + name[-1] + '\n')
+
+def get_schemes(templates=None):
+    """
+    Return a dictionary mapping output file names to naming schemes, for the given templates or the default schemes.
+    """
+    if templates:
+        return {template_filename(t): compile_template(t) for t in templates}
+    return SCHEMES
+
+
+def write_usernames(names, templates=None, suffix="", compress=False, dedup=False, capacity=DEFAULT_CAPACITY):
+    """
+    Write the account names for all naming schemes to their output files, with suffix added to the file names.
+    Returns a dictionary mapping the output files to the number of account names written.
+    """
+    outputs = []
+    try:
+        for filename, scheme in get_schemes(templates).items():
+            filename = filename.removesuffix(".txt") + suffix + ".txt"
+            if compress:
+                filename += ".gz"
+                f = gzip.open(filename, 'wt', encoding='utf-8', compresslevel=6)
             else:
-                f.write(name[0] + '\n')
+                f = open(filename, 'w', encoding='utf-8', buffering=BUFFER_SIZE)
+            seen = BloomFilter(capacity) if dedup else None
+            outputs.append([f, scheme, seen, filename, 0])
+        # single pass over all names, writing each name to every output file
+        for name in names:
+            for output in outputs:
+                f, scheme, seen = output[:3]
+                username = scheme(name)
+                if seen is None or not seen.add(username):
+                    f.write(username + '\n')
+                    output[4] += 1
+    finally:
+        for f, *_ in outputs:
+            f.close()
+    return {filename: count for _, _, _, filename, count in outputs}
+
+
+_SHARD_DATA = None
+
+
+def _init_shard_worker(*data):
+    global _SHARD_DATA
+    _SHARD_DATA = data
+
+
+def _generate_shard(shard, start, end):
+    firstnames, lastnames, templates, compress, dedup, capacity = _SHARD_DATA
+    if lastnames is None:
+        names = itertools.islice(firstnames, start, end)
+    else:
+        names = iter_product_range(firstnames, lastnames, start, end)
+    return write_usernames(names, templates, f".shard{shard}", compress, dedup, capacity)
+
+
+def main(names_files, templates=None, translit=False, dedup=False, capacity=DEFAULT_CAPACITY, shards=1, jobs=None, compress=False):
+    if shards <= 1:
+        write_usernames(iter_names(names_files, translit), templates, "", compress, dedup, capacity)
+        return
+
+    if len(names_files) == 1:
+        firstnames = list(iter_names(names_files, translit))
+        lastnames = None
+        total = len(firstnames)
+    else:
+        firstnames = list(read_names(names_files[0], translit))
+        lastnames = list(read_names(names_files[1], translit))
+        total = len(firstnames) * len(lastnames)
+    # contiguous, evenly sized ranges of the names, independent of the number of processes
+    bounds = [total * k // shards for k in range(shards + 1)]
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_shard_worker,
+                             initargs=(firstnames, lastnames, templates, compress, dedup, capacity)) as executor:
+        results = list(executor.map(_generate_shard, range(shards), bounds[:-1], bounds[1:]))
+
+    manifest = {
+        "shards": shards,
+        "names": total,
+        "files": {filename: count for result in results for filename, count in result.items()},
+    }
+    with open("manifest.json", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
 
 
 if __name__ == '__main__':
     argparser = argparse.ArgumentParser(description="Generate lists of potential usernames")
     argparser.add_argument('names', nargs='+', help="Files containing name entries. Either one file with 'Firstname Lastname' entries combined, or two separate files with 'Firstname' and 'Lastname' entries for cartesian product.")
+    argparser.add_argument('--template', '-t', action='append', help="Naming scheme template to use instead of the default ones, e.g. '{first}_{l}' or '{last}{f}{f2}' (can be given multiple times)")
+    argparser.add_argument('--transliterate', action='store_true', help="Transliterate umlauts (e.g. ä to ae) and strip accents")
+    argparser.add_argument('--dedup', action='store_true', help="Skip duplicate account names using a Bloom filter (may rarely skip a unique name, per shard with --shards)")
+    argparser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY, help=f"Expected number of names per output file for --dedup (default: {DEFAULT_CAPACITY})")
+    argparser.add_argument('--shards', type=int, default=1, help="Split the names into this many evenly sized shards (scheme.shardK.txt) and write a manifest.json")
+    argparser.add_argument('--jobs', '-j', type=int, help="Number of processes generating shards (default: number of CPUs)")
+    argparser.add_argument('--gzip', action='store_true', help="Write gzip-compressed output files")
     parsed_args = argparser.parse_args()
     if len(parsed_args.names) > 2:
         argparser.error("Give either one file with 'Firstname Lastname' entries combined, or two separate files with 'Firstname' and 'Lastname' entries for cartesian product.")
-    main(parsed_args.names)
+    if parsed_args.template:
+        try:
+            get_schemes(parsed_args.template)
+        except ValueError as e:
+            argparser.error(str(e))
+    main(parsed_args.names, parsed_args.template, parsed_args.transliterate, parsed_args.dedup, parsed_args.capacity,
+         parsed_args.shards, parsed_args.jobs, parsed_args.gzip)
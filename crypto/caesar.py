@@ -2,10 +2,58 @@
 
 """
 Tool to apply Caesar (i.e. rotation) ciphers to a text (encryption or decryption).
+
+The rotations are precomputed as translation tables, so large inputs can
+be processed with str.translate / bytes.translate. Files (or stdin) are
+processed in chunks to keep memory usage constant.
+
+The crack mode scores all rotations of many ciphertexts (one per line)
+against a language profile and prints the most likely plaintexts.
+This requires numpy.
 """
 
-import string
 import argparse
+import string
+import sys
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+CHUNK_SIZE = 1 << 20
+CRACK_BATCH_SIZE = 1 << 24
+
+# relative letter frequencies of the English language
+ENGLISH_PROFILE = [
+    8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966, 0.153, 0.772, 4.025, 2.406,
+    6.749, 7.507, 1.929, 0.095, 5.987, 6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074,
+]
+
+
+def _rotation(alphabet, count):
+    return alphabet[count:] + alphabet[:count]
+
+
+def _build_tables():
+    """
+    Build the translation tables for all 26 rotations (for str and bytes).
+    """
+
+    lower = string.ascii_lowercase
+    upper = string.ascii_uppercase
+    str_tables = []
+    bytes_tables = []
+    for count in range(26):
+        src = lower + upper
+        dst = _rotation(lower, count) + _rotation(upper, count)
+        str_tables.append(str.maketrans(src, dst))
+        bytes_tables.append(bytes.maketrans(src.encode(), dst.encode()))
+    return str_tables, bytes_tables
+
+
+STR_TABLES, BYTES_TABLES = _build_tables()
 
 
 def rot_char(char, count):
@@ -13,21 +61,7 @@ def rot_char(char, count):
     Rotate a single character by count positions if it is in A-Z or a-z.
     """
 
-    if char in string.ascii_uppercase:
-        c = ord(char) + count
-        while c > ord('Z'):
-            c -= 26
-        while c < ord('A'):
-            c += 26
-        return chr(c)
-    if char in string.ascii_lowercase:
-        c = ord(char) + count
-        while c > ord('z'):
-            c -= 26
-        while c < ord('a'):
-            c += 26
-        return chr(c)
-    return char
+    return char.translate(STR_TABLES[count % 26])
 
 
 def crypt(text, count):
@@ -35,9 +69,12 @@ def crypt(text, count):
     Apply the rotation cipher to the text.
 
     Each character is rotated by count positions.
+    Accepts str as well as bytes-like input.
     """
 
-    return "".join(rot_char(c, count) for c in text)
+    if isinstance(text, str):
+        return text.translate(STR_TABLES[count % 26])
+    return bytes(text).translate(BYTES_TABLES[count % 26])
 
 
 def crypt_all(text):
@@ -48,14 +85,137 @@ def crypt_all(text):
     return [crypt(text, count) for count in range(1, 26)]
 
 
+def crypt_stream(infile, outfile, count, chunk_size=CHUNK_SIZE):
+    """
+    Apply the rotation cipher to a binary input stream and write the result to a binary output stream.
+
+    The input is processed in chunks of chunk_size bytes. Since only ASCII letters
+    are rotated, multi-byte encodings like UTF-8 pass through unchanged.
+    """
+
+    table = BYTES_TABLES[count % 26]
+    while chunk := infile.read(chunk_size):
+        outfile.write(chunk.translate(table))
+    outfile.flush()
+
+
+def load_profile(filename):
+    """
+    Load a language profile from a file with 'letter frequency' entries, one per line.
+
+    Letters missing in the file get a tiny frequency, so they are unlikely but not impossible.
+    """
+
+    profile = [0.0] * 26
+    with open(filename, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                letter, frequency = line.split()
+                profile[ord(letter.lower()) - ord('a')] = float(frequency)
+    return profile
+
+
+def letter_counts(lines):
+    """
+    Return a (len(lines), 26) matrix with the letter counts (case-insensitive) of each line of bytes.
+    """
+
+    lengths = np.fromiter(map(len, lines), dtype=np.int64, count=len(lines))
+    data = np.frombuffer(b"".join(lines), dtype=np.uint8) | 0x20
+    line_ids = np.repeat(np.arange(len(lines), dtype=np.int64), lengths)
+    mask = (data >= ord('a')) & (data <= ord('z'))
+    indices = line_ids[mask] * 26 + (data[mask] - ord('a'))
+    return np.bincount(indices, minlength=len(lines) * 26).reshape(len(lines), 26)
+
+
+def score_rotations(counts, profile=ENGLISH_PROFILE, metric="loglik"):
+    """
+    Score all 26 rotations for each row of a letter count matrix against a language profile.
+
+    Returns a (rows, 26) matrix, where column r is the score of the text rotated by r.
+    With metric 'loglik' (log-likelihood) higher is better, with 'chi2' (chi-squared) lower is better.
+    """
+
+    p = np.asarray(profile, dtype=np.float64)
+    p = np.maximum(p / p.sum(), 1e-6)
+    # index[c, r] is the plaintext letter of ciphertext letter c after rotation by r
+    index = (np.arange(26)[:, None] + np.arange(26)[None, :]) % 26
+    if metric == "chi2":
+        n = counts.sum(axis=1, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = (counts.astype(np.float64) ** 2) @ (1 / p[index]) / n - n
+        return np.nan_to_num(scores)
+    return counts @ np.log(p[index])
+
+
+def crack(lines, top=1, profile=ENGLISH_PROFILE, metric="loglik"):
+    """
+    Crack a batch of ciphertexts (list of bytes).
+
+    Yields a list of (rotation, score, plaintext) tuples with the top candidates for each ciphertext.
+    """
+
+    scores = score_rotations(letter_counts(lines), profile, metric)
+    order = np.argsort(scores if metric == "chi2" else -scores, axis=1, kind="stable")[:, :top]
+    for line, line_scores, rotations in zip(lines, scores, order):
+        yield [(int(r), float(line_scores[r]), line.translate(BYTES_TABLES[r])) for r in rotations]
+
+
+def crack_stream(infile, outfile, top=1, profile=ENGLISH_PROFILE, metric="loglik", batch_size=CRACK_BATCH_SIZE):
+    """
+    Crack the ciphertexts from a binary input stream (one per line) in batches of roughly batch_size bytes.
+
+    Writes tab-separated 'line rotation score plaintext' entries to the binary output stream.
+    """
+
+    lineno = 0
+    while lines := infile.readlines(batch_size):
+        lines = [line.rstrip(b"\r\n") for line in lines]
+        output = []
+        for candidates in crack(lines, top, profile, metric):
+            lineno += 1
+            for rotation, score, plaintext in candidates:
+                output.append(b"%d\t%d\t%.2f\t%s\n" % (lineno, rotation, score, plaintext))
+        outfile.write(b"".join(output))
+    outfile.flush()
+
+
 if __name__ == "__main__":
 
     argparser = argparse.ArgumentParser(description="Apply Caesar (rotation) ciphers to a text.")
-    argparser.add_argument("text", help="the text to encrypt/decrypt")
+    argparser.add_argument("text", nargs="?", help="the text to encrypt/decrypt")
     argparser.add_argument("-n", type=int, choices=range(1, 26), help="rotation count")
+    argparser.add_argument("-f", "--file", help="stream the text from a file instead ('-' for stdin), requires -n")
+    argparser.add_argument("--crack", metavar="FILE", help="crack the ciphertexts in a file (one per line, '-' for stdin)")
+    argparser.add_argument("--top", type=int, default=1, help="number of candidates to print per ciphertext in crack mode (default: 1)")
+    argparser.add_argument("--metric", choices=["loglik", "chi2"], default="loglik", help="scoring metric in crack mode (default: loglik)")
+    argparser.add_argument("--profile", help="file with 'letter frequency' lines to use as language profile (default: English)")
     args = argparser.parse_args()
 
-    if args.n:
+    if [args.text, args.file, args.crack].count(None) != 2:
+        argparser.error("give either a text, --file or --crack")
+
+    if args.crack:
+        if np is None:
+            print("Error: Missing dependency numpy", file=sys.stderr)
+            sys.exit(1)
+        if not 1 <= args.top <= 26:
+            argparser.error("--top must be between 1 and 26")
+        lang_profile = load_profile(args.profile) if args.profile else ENGLISH_PROFILE
+        if args.crack == "-":
+            crack_stream(sys.stdin.buffer, sys.stdout.buffer, args.top, lang_profile, args.metric)
+        else:
+            with open(args.crack, "rb") as f:
+                crack_stream(f, sys.stdout.buffer, args.top, lang_profile, args.metric)
+    elif args.file:
+        if not args.n:
+            argparser.error("--file requires a rotation count -n")
+        if args.file == "-":
+            crypt_stream(sys.stdin.buffer, sys.stdout.buffer, args.n)
+        else:
+            with open(args.file, "rb") as f:
+                crypt_stream(f, sys.stdout.buffer, args.n)
+    elif args.n:
         print(crypt(args.text, args.n))
     else:
         for i, s in enumerate(crypt_all(args.text), start=1):
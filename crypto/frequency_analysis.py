@@ -2,43 +2,278 @@
 
 """
 Tool to analyse the frequencies of the characters in a given text.
+
+Besides a text given on the command line, files and stdin can be analysed.
+These are processed as bytes in chunks (files are memory-mapped), so large
+inputs do not need to fit into memory. Unigrams, bigrams and trigrams are
+supported. If numpy is available, it is used to speed up the counting.
+
+Large files can be split into byte ranges which are counted in parallel.
+The resulting histogram can be saved and updated later, in which case
+only the data appended to a file since the last run is analysed.
 """
 
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import json
 import math
+import mmap
 import argparse
+import os
+import sys
+
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+
+CHUNK_SIZE = 1 << 24
+
+
+def analyse(text, n=1):
+    """
+    Return a dictionary with the number of occurrences for each character (or n-gram) in the given string.
+    """
+
+    if n == 1:
+        return Counter(text)
+    return Counter(map("".join, zip(*(text[i:] for i in range(n)))))
+
+
+def read_chunks(filename, chunk_size=CHUNK_SIZE, start=0, end=None):
+    """
+    Yield the content of a file ('-' for stdin) in chunks of bytes.
+
+    Regular files are memory-mapped and yielded as memoryview slices without copying.
+    For regular files, only the byte range from start to end is read.
+    """
+
+    if filename == "-":
+        while chunk := sys.stdin.buffer.read(chunk_size):
+            yield chunk
+        return
+    with open(filename, "rb") as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return
+        end = len(mm) if end is None else min(end, len(mm))
+        with mm, memoryview(mm) as view:
+            for offset in range(start, end, chunk_size):
+                with view[offset:min(offset + chunk_size, end)] as chunk:
+                    yield chunk
 
 
-def analyse(text):
+def _count_chunk(chunk, n, counter, table):
     """
-    Return a dictionary with the number of occurrences for each character in the given string.
+    Add the n-grams in a chunk of bytes to the counter (or the bincount table for n < 3 with numpy).
     """
 
-    frequencies = {}
-    for c in text:
-        if c in frequencies:
-            frequencies[c] += 1
+    if np is None:
+        if n == 1:
+            counter.update({bytes([b]): c for b, c in Counter(bytes(chunk)).items()})
         else:
-            frequencies[c] = 1
-    return frequencies
+            data = bytes(chunk)
+            counter.update(data[i:i + n] for i in range(len(data) - n + 1))
+        return
+    data = np.frombuffer(chunk, dtype=np.uint8).astype(np.uint32)
+    codes = data[:len(data) - n + 1].copy()
+    for i in range(1, n):
+        codes <<= 8
+        codes |= data[i:len(data) - n + 1 + i]
+    if table is not None:
+        table += np.bincount(codes, minlength=len(table))
+    else:
+        values, counts = np.unique(codes, return_counts=True)
+        counter.update({v.to_bytes(n, "big"): c for v, c in zip(values.tolist(), counts.tolist())})
+
+
+def analyse_chunks(chunks, n=1):
+    """
+    Return a Counter with the number of occurrences for each n-gram (as bytes) in an iterable of byte chunks.
+
+    The last n-1 bytes of each chunk are carried over, so n-grams spanning chunk borders are counted.
+    """
+
+    counter = Counter()
+    table = np.zeros(256 ** n, dtype=np.int64) if np is not None and n < 3 else None
+    carry = b""
+    for chunk in chunks:
+        if carry:
+            # count the n-grams spanning the border separately to avoid copying the chunk
+            border = carry + bytes(chunk[:n - 1])
+            _count_chunk(border, n, counter, table)
+        _count_chunk(chunk, n, counter, table)
+        carry = bytes(chunk[-(n - 1):]) if n > 1 else b""
+    if table is not None:
+        for code in np.flatnonzero(table).tolist():
+            counter[code.to_bytes(n, "big")] = int(table[code])
+    return counter
+
+
+def _analyse_range(filename, n, start, end, chunk_size):
+    """
+    Count the n-grams starting in the byte range from start to end of a file.
+    """
+
+    return analyse_chunks(read_chunks(filename, chunk_size, start, end + n - 1), n)
+
+
+def analyse_file(filename, n=1, chunk_size=CHUNK_SIZE, start=0, jobs=1):
+    """
+    Return a Counter with the number of occurrences for each n-gram (as bytes) in the given file ('-' for stdin).
+
+    Only n-grams starting at offset start or later are counted. With jobs > 1, the file is
+    split into byte ranges which are counted in a process pool and the results are merged.
+    """
+
+    if filename == "-" or jobs <= 1:
+        return analyse_chunks(read_chunks(filename, chunk_size, start), n)
+    size = os.path.getsize(filename)
+    # use a few more ranges than jobs to even out the load
+    range_size = max(chunk_size, -(-(size - start) // (jobs * 4)))
+    ranges = [(s, min(s + range_size, size)) for s in range(start, size, range_size)]
+    counter = Counter()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_analyse_range, filename, n, s, e, chunk_size) for s, e in ranges]
+        for future in futures:
+            counter.update(future.result())
+    return counter
+
+
+def load_histogram(filename):
+    """
+    Load a saved histogram from a JSON file.
+
+    Returns the n-gram length, a Counter with the n-grams (as bytes) and a dictionary
+    mapping the analysed files to the number of bytes already processed.
+    """
+
+    with open(filename, encoding="utf-8") as f:
+        histogram = json.load(f)
+    counter = Counter({bytes.fromhex(k): v for k, v in histogram["counts"].items()})
+    return histogram["n"], counter, histogram["offsets"]
 
 
-def show_statistic(frequencies, sort=0):
+def save_histogram(filename, n, counter, offsets):
+    """
+    Save a histogram to a JSON file, which can be loaded and updated later.
+    """
+
+    histogram = {
+        "n": n,
+        "counts": {k.hex(): v for k, v in counter.items()},
+        "offsets": offsets,
+    }
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(histogram, f)
+
+
+def update_histogram(histogram_file, filename, n=1, jobs=1):
+    """
+    Add the n-grams of a file to a saved histogram (created if it does not exist) and return it.
+
+    If the file was analysed before, only the bytes appended since then are processed.
+    """
+
+    counter = Counter()
+    offsets = {}
+    if os.path.exists(histogram_file):
+        saved_n, counter, offsets = load_histogram(histogram_file)
+        if saved_n != n:
+            raise ValueError(f"Histogram {histogram_file} contains {saved_n}-grams, not {n}-grams")
+    path = os.path.realpath(filename)
+    size = os.path.getsize(path)
+    offset = offsets.get(path, 0)
+    if size < offset:
+        raise ValueError(f"{filename} is smaller than at the last analysis")
+    # n-grams spanning the previous end of the file have not been counted yet
+    counter.update(analyse_file(path, n, start=max(offset - n + 1, 0), jobs=jobs))
+    offsets[path] = size
+    save_histogram(histogram_file, n, counter, offsets)
+    return counter
+
+
+def format_key(key):
+    """
+    Return a printable representation of a character or n-gram.
+    """
+
+    if isinstance(key, str):
+        return key
+    return "".join(chr(b) if 0x20 <= b < 0x7f else f"\\x{b:02x}" for b in key)
+
+
+def hex_key(key):
+    """
+    Return the hex encoding of a character or n-gram.
+    """
+
+    return key.encode().hex() if isinstance(key, str) else key.hex()
+
+
+def show_statistic(frequencies, sort=0, top=None, output_format="table"):
     """
     Visualise the frequencies in a diagram.
+
+    If top is given, only the top most common entries are shown.
+    With output_format 'json' or 'csv', a machine-readable table is printed instead.
     """
 
     n = sum(frequencies[c] for c in frequencies)
-    for key, value in sorted(frequencies.items(), key=lambda x: x[sort]):
+    items = Counter(frequencies).most_common(top) if top else frequencies.items()
+    items = sorted(items, key=lambda x: x[sort])
+    if output_format == "json":
+        json.dump([{
+            "key": format_key(key),
+            "hex": hex_key(key),
+            "count": value,
+            "percent": (value * 100) / n,
+        } for key, value in items], sys.stdout, indent=2)
+        print()
+        return
+    if output_format == "csv":
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["key", "hex", "count", "percent"])
+        for key, value in items:
+            writer.writerow([format_key(key), hex_key(key), value, (value * 100) / n])
+        return
+    for key, value in items:
         percent = (value * 100) / n
-        print(f"[{key}] {percent:6.2f}%| {'#'*math.ceil(percent)}")
+        print(f"[{format_key(key)}] {percent:6.2f}%| {'#'*math.ceil(percent)}")
 
 
 if __name__ == "__main__":
 
     argparser = argparse.ArgumentParser(description="Analyse the frequencies of the characters in a text.")
-    argparser.add_argument("text", help="the text to analyse")
+    argparser.add_argument("text", nargs="?", help="the text to analyse")
+    argparser.add_argument("--file", "-f", help="analyse the bytes of a file instead ('-' for stdin)")
+    argparser.add_argument("--ngram", "-n", type=int, choices=[1, 2, 3], default=1, help="length of the n-grams to count (default: 1)")
+    argparser.add_argument("--top", type=int, help="only show the top N most common entries")
+    argparser.add_argument("--jobs", "-j", type=int, default=1, help="number of processes to analyse a file in parallel (default: 1)")
+    argparser.add_argument("--histogram", metavar="FILE", help="add the results of --file to a saved histogram (created if missing)")
+    argparser.add_argument("--format", dest="output_format", choices=["table", "json", "csv"], default="table",
+                           help="output format (default: table)")
     argparser.add_argument("--sort", action='store_const', const=1, default=0,
                            help="sort result table according to number of occurrences")
     args = argparser.parse_args()
 
-    show_statistic(analyse(args.text), sort=args.sort)
+    if (args.text is None) == (args.file is None):
+        argparser.error("give either a text or --file")
+
+    if args.histogram:
+        if not args.file or args.file == "-":
+            argparser.error("--histogram requires --file with a regular file")
+        try:
+            result = update_histogram(args.histogram, args.file, args.ngram, args.jobs)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+    elif args.file:
+        result = analyse_file(args.file, args.ngram, jobs=args.jobs)
+    else:
+        result = analyse(args.text, args.ngram)
+    show_statistic(result, sort=args.sort, top=args.top, output_format=args.output_format)
@@ -4,33 +4,251 @@
 This tool can generate the ASN1 input for OpenSSL asn1parse.
 
 It allows to create keys with specifically chosen RSA parameters.
+
+The keys can also be written directly in DER or PEM format (PKCS#1),
+without a round trip through OpenSSL. In bulk mode, many keys are
+written at once, either from a file with the parameters or generated
+randomly with a chosen weakness (requires gmpy2). This is useful to
+create test data for the RSA attack tools.
 """
 
 import argparse
+import base64
+import os
+import random
+import sys
+
+try:
+    import gmpy2
+except ModuleNotFoundError:
+    gmpy2 = None
+
+
+WEAKNESSES = ["none", "close-primes", "small-d", "small-e", "small-factor", "shared-factor", "common-modulus"]
+
+
+def rsa_key_conf(p, q, e, d):
+    """
+    Return the asn1parse configuration for an RSA private key with the given parameters.
+    """
+
+    n = p * q
+    e1 = d % (p - 1)
+    e2 = d % (q - 1)
+    coeff = pow(q, p - 2, p)
+
+    return "\n".join([
+        "asn1=SEQUENCE:rsa_key",
+        "[rsa_key]",
+        "version=INTEGER:0",
+        "modulus=INTEGER:" + str(n),
+        "pubExp=INTEGER:" + str(e),
+        "privExp=INTEGER:" + str(d),
+        "p=INTEGER:" + str(p),
+        "q=INTEGER:" + str(q),
+        "e1=INTEGER:" + str(e1),
+        "e2=INTEGER:" + str(e2),
+        "coeff=INTEGER:" + str(coeff),
+    ])
+
+
+def _der_length(length):
+    if length < 0x80:
+        return bytes([length])
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(encoded)]) + encoded
+
+
+def _der_integer(value):
+    # one extra bit for the sign, so positive values with the high bit set get a leading zero byte
+    encoded = value.to_bytes(value.bit_length() // 8 + 1, "big")
+    return b"\x02" + _der_length(len(encoded)) + encoded
+
+
+def _der_sequence(*values):
+    content = b"".join(_der_integer(v) for v in values)
+    return b"\x30" + _der_length(len(content)) + content
+
+
+def rsa_private_key_der(p, q, e, d):
+    """
+    Return the RSA private key with the given parameters in DER format (PKCS#1 RSAPrivateKey).
+    """
+
+    return _der_sequence(0, p * q, e, d, p, q, d % (p - 1), d % (q - 1), pow(q, p - 2, p))
+
+
+def rsa_public_key_der(n, e):
+    """
+    Return the RSA public key with the given parameters in DER format (PKCS#1 RSAPublicKey).
+    """
+
+    return _der_sequence(n, e)
+
+
+def der_to_pem(der, label):
+    """
+    Return the PEM encoding of DER data with the given label (e.g. 'RSA PRIVATE KEY').
+    """
+
+    b64 = base64.b64encode(der).decode()
+    lines = [b64[i:i + 64] for i in range(0, len(b64), 64)]
+    return "\n".join([f"-----BEGIN {label}-----", *lines, f"-----END {label}-----", ""]).encode()
+
+
+def encode_key(p, q, e, d, output_format):
+    """
+    Return the private key with the given parameters as bytes in the given format (conf, der or pem).
+    """
+
+    if output_format == "conf":
+        return (rsa_key_conf(p, q, e, d) + "\n").encode()
+    der = rsa_private_key_der(p, q, e, d)
+    if output_format == "der":
+        return der
+    return der_to_pem(der, "RSA PRIVATE KEY")
+
+
+def private_exponent(p, q, e):
+    """
+    Compute the private exponent for the given primes and public exponent.
+    """
+
+    return pow(e, -1, (p - 1) * (q - 1))
+
+
+def read_parameters(filename):
+    """
+    Read RSA parameters from a file with 'p q e [d]' entries one per line (decimal or 0x-prefixed hex).
+    Yields (p, q, e, d) tuples, the private exponent is computed if missing.
+    """
+
+    with open(filename, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                values = [int(v, 0) for v in line.split()]
+                p, q, e = values[:3]
+                d = values[3] if len(values) > 3 else private_exponent(p, q, e)
+                yield p, q, e, d
+
+
+def _random_prime(bits, rs):
+    return int(gmpy2.next_prime(gmpy2.mpz_urandomb(rs, bits) | (1 << (bits - 1))))
+
+
+def generate_parameters(count, bits=2048, weakness="none", seed=None):
+    """
+    Generate RSA parameters for count keys of the given size with a chosen weakness.
+    Yields (p, q, e, d) tuples.
+    """
+
+    rs = gmpy2.random_state(seed if seed is not None else random.SystemRandom().getrandbits(64))
+    half = bits // 2
+    shared_p = _random_prime(half, rs)
+    shared_q = _random_prime(bits - half, rs)
+    exponent = gmpy2.mpz(65537)
+    generated = 0
+    while generated < count:
+        e = 65537
+        if weakness == "shared-factor":
+            p, q = shared_p, _random_prime(bits - half, rs)
+        elif weakness == "common-modulus":
+            p, q = shared_p, shared_q
+            # distinct prime exponents are pairwise coprime
+            exponent = gmpy2.next_prime(exponent)
+            while gmpy2.gcd(exponent, (p - 1) * (q - 1)) != 1:
+                exponent = gmpy2.next_prime(exponent)
+            e = int(exponent)
+        elif weakness == "small-factor":
+            p, q = _random_prime(16, rs), _random_prime(bits - 16, rs)
+        elif weakness == "close-primes":
+            p = _random_prime(half, rs)
+            q = int(gmpy2.next_prime(p + gmpy2.mpz_urandomb(rs, half // 4)))
+        else:
+            p, q = _random_prime(half, rs), _random_prime(bits - half, rs)
+        if p == q:
+            continue
+        phi = (p - 1) * (q - 1)
+        if weakness == "small-d":
+            # below the bound n^(1/4)/3 of Wiener's attack
+            while True:
+                d = _random_prime(bits // 4 - 2, rs)
+                if gmpy2.gcd(d, phi) == 1:
+                    break
+            generated += 1
+            yield p, q, int(gmpy2.invert(d, phi)), d
+            continue
+        if weakness == "small-e":
+            e = 3
+            while gmpy2.gcd(e, phi) != 1:
+                p, q = _random_prime(half, rs), _random_prime(bits - half, rs)
+                phi = (p - 1) * (q - 1)
+        elif gmpy2.gcd(e, phi) != 1:
+            continue
+        generated += 1
+        yield p, q, e, int(gmpy2.invert(e, phi))
+
+
+def write_keys(parameters, output_dir, output_format="pem", public=False):
+    """
+    Write a private key file (NAME.key, NAME.der or NAME.conf) for each (p, q, e, d) tuple into a directory.
+    With public, the public key is also written as NAME.pem. Returns the number of keys written.
+    """
+
+    extension = {"pem": "key", "der": "der", "conf": "conf"}[output_format]
+    os.makedirs(output_dir, exist_ok=True)
+    count = 0
+    for count, (p, q, e, d) in enumerate(parameters, start=1):
+        name = os.path.join(output_dir, f"key{count:05d}")
+        with open(f"{name}.{extension}", "wb") as f:
+            f.write(encode_key(p, q, e, d, output_format))
+        if public:
+            with open(f"{name}.pem", "wb") as f:
+                f.write(der_to_pem(rsa_public_key_der(p * q, e), "RSA PUBLIC KEY"))
+    return count
 
 
 if __name__ == '__main__':
 
     argparser = argparse.ArgumentParser(description="Generate RSA Key configuration for OpenSSL asn1parse.")
-    argparser.add_argument("p", type=int, help="first prime")
-    argparser.add_argument("q", type=int, help="second prime")
-    argparser.add_argument("e", type=int, help="public exponent")
-    argparser.add_argument("d", type=int, help="private exponent")
+    argparser.add_argument("p", type=int, nargs="?", help="first prime")
+    argparser.add_argument("q", type=int, nargs="?", help="second prime")
+    argparser.add_argument("e", type=int, nargs="?", help="public exponent")
+    argparser.add_argument("d", type=int, nargs="?", help="private exponent")
+    argparser.add_argument("--format", dest="output_format", choices=["conf", "der", "pem"], default="conf",
+                           help="output format: asn1parse configuration, or PKCS#1 key in DER or PEM format (default: conf)")
+    argparser.add_argument("--public", action="store_true", help="output the public key (single key), or write it as NAME.pem as well (bulk mode)")
+    bulk_group = argparser.add_argument_group("bulk mode")
+    bulk_group.add_argument("--bulk", metavar="FILE", help="read 'p q e [d]' entries from a file, one key per line")
+    bulk_group.add_argument("--generate", metavar="COUNT", type=int, help="generate COUNT random keys (requires gmpy2)")
+    bulk_group.add_argument("--weakness", choices=WEAKNESSES, default="none", help="weakness of the generated keys (default: none)")
+    bulk_group.add_argument("--bits", type=int, default=2048, help="size of the generated keys (default: 2048)")
+    bulk_group.add_argument("--seed", type=int, help="seed for reproducible key generation")
+    bulk_group.add_argument("--output-dir", "-o", metavar="DIR", help="directory to write the keys to in bulk mode")
     args = argparser.parse_args()
 
-    n = args.p * args.q
-    e1 = args.d % (args.p - 1)
-    e2 = args.d % (args.q - 1)
-    coeff = pow(args.q, args.p - 2, args.p)
-
-    print("asn1=SEQUENCE:rsa_key")
-    print("[rsa_key]")
-    print("version=INTEGER:0")
-    print("modulus=INTEGER:" + str(n))
-    print("pubExp=INTEGER:" + str(args.e))
-    print("privExp=INTEGER:" + str(args.d))
-    print("p=INTEGER:" + str(args.p))
-    print("q=INTEGER:" + str(args.q))
-    print("e1=INTEGER:" + str(e1))
-    print("e2=INTEGER:" + str(e2))
-    print("coeff=INTEGER:" + str(coeff))
+    if args.bulk or args.generate:
+        if args.bulk and args.generate:
+            argparser.error("--bulk and --generate are mutually exclusive")
+        if not args.output_dir:
+            argparser.error("bulk mode requires --output-dir")
+        if args.generate:
+            if gmpy2 is None:
+                print("Error: Missing dependency gmpy2", file=sys.stderr)
+                sys.exit(1)
+            params = generate_parameters(args.generate, args.bits, args.weakness, args.seed)
+        else:
+            params = read_parameters(args.bulk)
+        written = write_keys(params, args.output_dir, args.output_format, args.public)
+        print(f"Wrote {written} keys to {args.output_dir}", file=sys.stderr)
+        sys.exit(0)
+
+    if None in (args.p, args.q, args.e, args.d):
+        argparser.error("p, q, e and d are required without bulk mode")
+
+    if args.public:
+        der = rsa_public_key_der(args.p * args.q, args.e)
+        output = der if args.output_format == "der" else der_to_pem(der, "RSA PUBLIC KEY")
+    else:
+        output = encode_key(args.p, args.q, args.e, args.d, args.output_format)
+    sys.stdout.buffer.write(output)
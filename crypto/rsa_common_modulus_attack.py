@@ -7,10 +7,18 @@ If two different RSA keys (i.e. different exponents) share
 the same modulus and a plaintext is encrypted with both keys,
 it is possible to recover the plaintext when observing both
 ciphertexts and public keys.
+
+In batch mode, a whole directory of public keys and ciphertexts is
+searched for keys sharing a modulus and the attack is performed for
+every matching pair of ciphertexts.
 """
 
 import argparse
 import base64
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import json
+import os
 import sys
 
 from cryptography.hazmat.primitives import serialization
@@ -26,17 +34,21 @@ def msg_file_to_int(msg, byteorder=sys.byteorder):
         return int.from_bytes(base64.b64decode(f.read()), byteorder=byteorder)
 
 
+def load_rsa_file(key):
+    """
+    Given an RSA public key file in PEM format, return its public numbers (n and e).
+    """
+    with open(key, 'rb') as f:
+        return serialization.load_pem_public_key(f.read()).public_numbers()
+
+
 def parse_rsa_files(key1, key2):
     """
     Given two RSA public key files in PEM format sharing the same modulus,
     return the modulus and the two exponents.
     """
-    rsa1 = None
-    rsa2 = None
-    with open(key1, 'rb') as f:
-        rsa1 = serialization.load_pem_public_key(f.read()).public_numbers()
-    with open(key2, 'rb') as f:
-        rsa2 = serialization.load_pem_public_key(f.read()).public_numbers()
+    rsa1 = load_rsa_file(key1)
+    rsa2 = load_rsa_file(key2)
     if rsa1.n != rsa2.n:
         print("Error: The keys do not share the same modulus!", file=sys.stderr)
         sys.exit(1)
@@ -58,15 +70,112 @@ def common_modulus_attack(modulus, exp1, exp2, msg1, msg2):
     return int(gmpy2.mod(tmp1 * tmp2, modulus))
 
 
+def load_rsa_directory(directory):
+    """
+    Load all RSA public keys (*.pem) in a directory along with their ciphertexts.
+
+    The base64-encoded ciphertexts for a key NAME.pem are expected in files
+    named NAME.msg or NAME.<anything>.msg.
+    Returns a dictionary mapping each modulus to a list of (key file, exponent, ciphertext files) tuples.
+    """
+    files = sorted(os.listdir(directory))
+    keys = {}
+    for filename in files:
+        if not filename.endswith(".pem"):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            rsa = load_rsa_file(path)
+        except (ValueError, AttributeError) as e:
+            print(f"Warning: Skipping {path}: {e}", file=sys.stderr)
+            continue
+        name = filename[:-len(".pem")]
+        msgs = [os.path.join(directory, m) for m in files
+                if m.endswith(".msg") and m.startswith(name + ".")]
+        keys.setdefault(rsa.n, []).append((path, rsa.e, msgs))
+    return keys
+
+
+def find_attackable_pairs(keys):
+    """
+    Given a dictionary as returned by load_rsa_directory, yield all pairs of keys
+    sharing a modulus with coprime exponents, as (modulus, key1, key2) tuples.
+    """
+    for modulus, entries in keys.items():
+        for key1, key2 in itertools.combinations(entries, 2):
+            if gmpy2.gcd(key1[1], key2[1]) == 1:
+                yield modulus, key1, key2
+
+
+def _batch_attack(modulus, key1, key2, msg1, msg2, byteorder):
+    """
+    Perform the attack for one pair of ciphertexts and return the result as dictionary,
+    or None if the ciphertexts do not belong to the same plaintext or cannot be processed.
+    """
+    # a single unreadable or unsuitable ciphertext must not abort the whole batch
+    try:
+        c1 = msg_file_to_int(msg1, byteorder)
+        c2 = msg_file_to_int(msg2, byteorder)
+        plain = common_modulus_attack(modulus, key1[1], key2[1], c1, c2)
+    except Exception as e:
+        print(f"Warning: Skipping {msg1} and {msg2}: {e.__class__.__name__}: {e}", file=sys.stderr)
+        return None
+    if gmpy2.powmod(plain, key1[1], modulus) != c1 % modulus or gmpy2.powmod(plain, key2[1], modulus) != c2 % modulus:
+        return None
+    plain_bytes = plain.to_bytes((plain.bit_length() + 7) // 8, byteorder=byteorder)
+    return {
+        "key1": key1[0],
+        "key2": key2[0],
+        "msg1": msg1,
+        "msg2": msg2,
+        "plaintext_hex": plain_bytes.hex(),
+        "plaintext": plain_bytes.decode(encoding="utf-8", errors="replace"),
+    }
+
+
+def batch_attack(directory, output, byteorder=sys.byteorder, jobs=None):
+    """
+    Perform the common modulus attack for all suitable pairs of keys and ciphertexts
+    in a directory and write the recovered plaintexts as JSON lines to the output file object.
+    Returns the number of recovered plaintexts.
+    """
+    tasks = []
+    for modulus, key1, key2 in find_attackable_pairs(load_rsa_directory(directory)):
+        for msg1, msg2 in itertools.product(key1[2], key2[2]):
+            tasks.append((modulus, key1[:2], key2[:2], msg1, msg2, byteorder))
+    found = 0
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for result in executor.map(_batch_attack, *zip(*tasks), chunksize=16) if tasks else []:
+            if result:
+                output.write(json.dumps(result) + "\n")
+                found += 1
+    return found
+
+
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser(description="Perform Common Modulus Attack against RSA")
-    argparser.add_argument("key1", help="File containing first RSA public key in PEM format")
-    argparser.add_argument("key2", help="File containing second RSA public key in PEM format")
-    argparser.add_argument("msg1", help="File containing first base64-encoded ciphertext")
-    argparser.add_argument("msg2", help="File containing second base64-encoded ciphertext")
+    argparser.add_argument("key1", nargs="?", help="File containing first RSA public key in PEM format")
+    argparser.add_argument("key2", nargs="?", help="File containing second RSA public key in PEM format")
+    argparser.add_argument("msg1", nargs="?", help="File containing first base64-encoded ciphertext")
+    argparser.add_argument("msg2", nargs="?", help="File containing second base64-encoded ciphertext")
     argparser.add_argument("--byteorder", default=sys.byteorder, choices=["little", "big"], help="Byteorder for message decoding")
+    argparser.add_argument("--batch", metavar="DIR", help="Attack all keys (NAME.pem) and ciphertexts (NAME[.*].msg) in a directory")
+    argparser.add_argument("--output", "-o", metavar="FILE", help="File to write the batch results to as JSON lines (default: stdout)")
+    argparser.add_argument("--jobs", "-j", type=int, help="Number of processes for batch mode (default: number of CPUs)")
     args = argparser.parse_args()
 
+    if args.batch:
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as out:
+                count = batch_attack(args.batch, out, args.byteorder, args.jobs)
+        else:
+            count = batch_attack(args.batch, sys.stdout, args.byteorder, args.jobs)
+        print(f"Recovered {count} plaintext(s)", file=sys.stderr)
+        sys.exit(0)
+
+    if not all((args.key1, args.key2, args.msg1, args.msg2)):
+        argparser.error("key1, key2, msg1 and msg2 are required without --batch")
+
     n, e1, e2 = parse_rsa_files(args.key1, args.key2)
     m1 = msg_file_to_int(args.msg1, args.byteorder)
     m2 = msg_file_to_int(args.msg2, args.byteorder)
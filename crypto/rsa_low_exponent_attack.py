@@ -10,51 +10,101 @@ recovered.
 """
 
 import argparse
-from functools import reduce
-from operator import mul
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import itertools
+import os
 import sys
 
 import gmpy2
 
+from rsa_shared_factor_attack import product_tree, remainder_tree
 
-def xgcd(b, n):
-    """
-    Extended Euclidean Algorithm
-    """
 
-    x0, x1, y0, y1 = 1, 0, 0, 1
-    while n != 0:
-        q, b, n = b // n, n, b % n
-        x0, x1 = x1, x0 - q * x1
-        y0, y1 = y1, y0 - q * y1
-    return b, x0, y0
+SUBSETS_PER_TASK = 64
 
 
 def crt(moduli, x_list):
     """
     Chinese Remainder Theorem
+
+    The inverses of M/m modulo m are obtained from M mod m^2 using a remainder tree,
+    the partial solutions are combined bottom-up along the product tree.
     """
 
-    modulus = reduce(mul, moduli, 1)
-    multipliers = []
-    for m in moduli:
-        M = modulus // m
-        _, inverse, _ = xgcd(M, m)
-        multipliers.append((inverse * M) % modulus)
-    result = 0
-    for multi, x in zip(multipliers, x_list):
-        result = (result + multi * x) % modulus
-    return result
+    tree = product_tree(moduli)
+    remainders = remainder_tree(tree[-1], tree)
+    terms = [gmpy2.mpz(x) * gmpy2.invert(r // m, m) % m for x, r, m in zip(x_list, remainders, tree[0])]
+    for level in tree[:-1]:
+        terms = [terms[i] * level[i + 1] + terms[i + 1] * level[i] if i + 1 < len(level) else terms[i]
+                 for i in range(0, len(level), 2)]
+    return terms[0] % tree[-1][0]
 
 
-def low_exponent_attack(moduli, ciphertexts):
+def low_exponent_attack(moduli, ciphertexts, e):
     """
     Low Exponent Attack against RSA
+
+    Returns the plaintext, or None if the e-th root of the CRT solution is not exact.
     """
 
     c = crt(moduli, ciphertexts)
-    root, _ = gmpy2.iroot(c, len(rsa_moduli))
-    return int(root)
+    root, exact = gmpy2.iroot(c, e)
+    return int(root) if exact else None
+
+
+_SUBSET_DATA = None
+
+
+def _init_subset_worker(moduli, ciphertexts, e):
+    global _SUBSET_DATA
+    _SUBSET_DATA = (moduli, ciphertexts, e)
+
+
+def _try_subsets(subsets):
+    """
+    Try the attack for the given subsets (tuples of indices) and return the first
+    successful (subset, plaintext), or None.
+    """
+
+    moduli, ciphertexts, e = _SUBSET_DATA
+    for subset in subsets:
+        try:
+            plain = low_exponent_attack([moduli[i] for i in subset], [ciphertexts[i] for i in subset], e)
+        except ZeroDivisionError:
+            # moduli in the subset are not coprime
+            continue
+        if plain is not None:
+            return subset, plain
+    return None
+
+
+def search_subsets(moduli, ciphertexts, e, jobs=None):
+    """
+    Search all subsets of e moduli and ciphertexts in a process pool until the attack succeeds.
+
+    Returns a tuple of the successful subset (indices) and the plaintext, or None.
+    """
+
+    subsets = itertools.combinations(range(len(moduli)), e)
+    max_pending = 2 * (jobs or os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_subset_worker,
+                             initargs=(moduli, ciphertexts, e)) as executor:
+        pending = set()
+        while True:
+            # keep a bounded number of tasks in flight
+            while len(pending) < max_pending:
+                batch = list(itertools.islice(subsets, SUBSETS_PER_TASK))
+                if not batch:
+                    break
+                pending.add(executor.submit(_try_subsets, batch))
+            if not pending:
+                return None
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if result := future.result():
+                    for f in pending:
+                        f.cancel()
+                    return result
 
 
 def parse_file(filename, input_base):
@@ -78,12 +128,35 @@ if __name__ == '__main__':
     argparser.add_argument("moduli", help="file containing the used RSA moduli one per line")
     argparser.add_argument("ciphertexts", help="file containing the ciphertexts one per line")
     argparser.add_argument("--hex", dest="base", action="store_const", const=16, default=10, help="data in input files is hex encoded")
+    argparser.add_argument("-e", type=int, help="public exponent (default: number of moduli)")
+    argparser.add_argument("--jobs", "-j", type=int, help="number of processes for the subset search (default: number of CPUs)")
     args = argparser.parse_args()
 
     rsa_moduli = parse_file(args.moduli, args.base)
     rsa_ciphertexts = parse_file(args.ciphertexts, args.base)
+    if len(rsa_moduli) != len(rsa_ciphertexts):
+        print("Error: The number of moduli and ciphertexts differs!", file=sys.stderr)
+        sys.exit(1)
+    exponent = args.e or len(rsa_moduli)
+    if len(rsa_moduli) < exponent:
+        print(f"Error: At least e={exponent} moduli and ciphertexts are required!", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        plain_int = low_exponent_attack(rsa_moduli, rsa_ciphertexts, exponent)
+    except ZeroDivisionError:
+        print("Warning: The moduli are not pairwise coprime (try the shared factor attack)", file=sys.stderr)
+        plain_int = None
+    if plain_int is None and len(rsa_moduli) > exponent:
+        print(f"Attack with all ciphertexts failed, searching subsets of size {exponent}...", file=sys.stderr)
+        found = search_subsets(rsa_moduli, rsa_ciphertexts, exponent, args.jobs)
+        if found:
+            subset, plain_int = found
+            print(f"Attack succeeded with the entries in lines {', '.join(str(i + 1) for i in subset)}", file=sys.stderr)
+    if plain_int is None:
+        print("Error: No exact root found, the attack failed!", file=sys.stderr)
+        sys.exit(1)
 
-    plain_int = low_exponent_attack(rsa_moduli, rsa_ciphertexts)
     print("Plaintext (integer):")
     print(plain_int)
 
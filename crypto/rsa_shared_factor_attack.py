@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+"""
+Tool to find RSA keys sharing a prime factor.
+
+If two different RSA moduli share a prime (e.g. due to bad randomness
+during key generation), both can be factored by computing their gcd.
+For large sets of keys, the gcd of each modulus with the product of
+all other moduli is computed efficiently with a product tree and a
+remainder tree (batch GCD).
+
+The private keys of the factored moduli can be written as configuration
+for OpenSSL asn1parse.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
+import sys
+
+import gmpy2
+
+from gen_rsa_key_conf import rsa_key_conf
+from rsa_common_modulus_attack import load_rsa_file
+
+
+def _multiply_pairs(level):
+    """
+    Multiply adjacent pairs of a list of numbers.
+    """
+    return [level[i] * level[i + 1] if i + 1 < len(level) else level[i] for i in range(0, len(level), 2)]
+
+
+def product_tree(moduli, levels=None):
+    """
+    Return the product tree of the given moduli as a list of levels, from the leaves to the root.
+    If levels is given, stop after that many levels of multiplications.
+    """
+    tree = [[gmpy2.mpz(n) for n in moduli]]
+    while len(tree[-1]) > 1 and (levels is None or len(tree) <= levels):
+        tree.append(_multiply_pairs(tree[-1]))
+    return tree
+
+
+def remainder_tree(remainders, tree):
+    """
+    Given the remainders for the top level of a product tree, descend the tree by
+    reducing modulo the squares of the nodes and return the remainders for the leaves.
+    """
+    for level in reversed(tree[:-1]):
+        remainders = [remainders[i // 2] % (node * node) for i, node in enumerate(level)]
+    return remainders
+
+
+def _leaf_gcds(remainders, leaves):
+    return [int(gmpy2.gcd(r // n, n)) for r, n in zip(remainders, leaves)]
+
+
+def _subtree_gcds(tree, remainder):
+    return _leaf_gcds(remainder_tree([remainder], tree), tree[0])
+
+
+def batch_gcd(moduli, jobs=1):
+    """
+    Compute gcd(n, product of all other moduli) for each modulus n.
+    Returns a list of gcds in the same order as the moduli.
+
+    With jobs > 1, the moduli are split into one subtree per process. The lower levels of the
+    product tree and the remainder tree are computed in parallel within each subtree,
+    only the upper levels connecting the subtrees are computed in the main process.
+    The subtrees are passed back to the processes for the remainder tree, so they are only built once.
+    """
+    if len(moduli) < 2:
+        return [1] * len(moduli)
+    if jobs <= 1:
+        tree = product_tree(moduli)
+        return _leaf_gcds(remainder_tree(tree[-1], tree), tree[0])
+
+    levels = max(1, math.ceil(math.log2(-(-len(moduli) // jobs))))
+    size = 2 ** levels
+    chunks = [moduli[i:i + size] for i in range(0, len(moduli), size)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        subtrees = list(executor.map(product_tree, chunks, [levels] * len(chunks)))
+        upper = product_tree([tree[-1][0] for tree in subtrees])
+        remainders = remainder_tree(upper[-1], upper)
+        results = executor.map(_subtree_gcds, subtrees, remainders)
+        return [g for gcds in results for g in gcds]
+
+
+def load_keys(paths):
+    """
+    Load RSA public keys in PEM format from the given files and directories (*.pem).
+    Returns a dictionary mapping each modulus to a list of (key file, exponent) tuples.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(".pem"))
+        else:
+            files.append(path)
+    keys = {}
+    for filename in files:
+        try:
+            rsa = load_rsa_file(filename)
+        except (ValueError, AttributeError) as e:
+            print(f"Warning: Skipping {filename}: {e}", file=sys.stderr)
+            continue
+        keys.setdefault(rsa.n, []).append((filename, rsa.e))
+    return keys
+
+
+def shared_factor_attack(moduli, jobs=1):
+    """
+    Find moduli sharing a prime factor with another modulus.
+    Returns a dictionary mapping each factored modulus to its factors (p, q).
+
+    If a modulus shares both primes with other moduli, the batch gcd yields the
+    modulus itself. These few cases are resolved by pairwise gcds.
+    """
+    factored = {}
+    for n, g in zip(moduli, batch_gcd(moduli, jobs)):
+        if g == n:
+            g = next((h for h in (gmpy2.gcd(n, m) for m in moduli if m != n) if 1 < h < n), 1)
+        if g != 1:
+            factored[n] = (int(g), n // int(g))
+    return factored
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Find RSA keys sharing a prime factor using batch GCD")
+    argparser.add_argument("keys", nargs="+", help="Files containing RSA public keys in PEM format, or directories with such files (*.pem)")
+    argparser.add_argument("--jobs", "-j", type=int, default=1, help="Number of processes to compute the subtrees with (default: 1)")
+    argparser.add_argument("--output-dir", "-o", metavar="DIR", help="Directory to write the asn1parse configuration of factored private keys to")
+    args = argparser.parse_args()
+
+    rsa_keys = load_keys(args.keys)
+    for modulus, entries in rsa_keys.items():
+        if len(entries) > 1:
+            print(f"Warning: Modulus shared by {', '.join(f for f, _ in entries)} (try the common modulus attack)", file=sys.stderr)
+
+    results = shared_factor_attack(list(rsa_keys), args.jobs)
+    print(f"Factored {len(results)} of {len(rsa_keys)} moduli")
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for modulus, (p, q) in results.items():
+        for filename, e in rsa_keys[modulus]:
+            print(f"{filename}: p={p} q={q}")
+            if args.output_dir:
+                d = int(gmpy2.invert(e, (p - 1) * (q - 1)))
+                conf = os.path.join(args.output_dir, os.path.basename(filename).removesuffix(".pem") + ".conf")
+                with open(conf, "w", encoding="utf-8") as f:
+                    f.write(rsa_key_conf(p, q, e, d) + "\n")
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+
+"""
+Tool to triage a corpus of RSA public keys for common weaknesses.
+
+Each key is checked in a process pool for
+- small prime factors (trial division),
+- primes close to each other (Fermat factorization),
+- a small private exponent (Wiener's continued fraction attack),
+each limited by a configurable time budget.
+The whole corpus is additionally checked for keys sharing a modulus
+(common modulus attack) and for small public exponents shared by
+enough keys (low exponent attack).
+
+Results of the per-key checks can be stored in a cache file, so that
+a rerun over a grown corpus only processes the new keys. Cached checks
+are only run again if they timed out and a larger --budget is given,
+or if a higher --trial-bound is given for trial division.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import functools
+import hashlib
+import json
+import os
+import sys
+import time
+
+import gmpy2
+
+from gen_rsa_key_conf import rsa_key_conf
+from rsa_shared_factor_attack import load_keys
+
+
+DEFAULT_BUDGET = 1.0
+TRIAL_BOUND = 1000000
+LOW_EXPONENT_BOUND = 65537
+
+
+@functools.lru_cache(maxsize=None)
+def _primorial(bound):
+    return gmpy2.primorial(bound)
+
+
+def trial_division(n, e, deadline):
+    """
+    Find a prime factor up to TRIAL_BOUND by computing the gcd with the primorial.
+    """
+    g = gmpy2.gcd(n, _primorial(TRIAL_BOUND))
+    if g == 1:
+        return None
+    p = g if gmpy2.is_prime(g) else next(q for q in range(2, TRIAL_BOUND + 1) if g % q == 0)
+    return int(p), int(n // p)
+
+
+def fermat(n, e, deadline):
+    """
+    Fermat factorization, which is fast if the primes are close to each other.
+    """
+    a = gmpy2.isqrt(n)
+    if a * a < n:
+        a += 1
+    b2 = a * a - n
+    i = 0
+    while not gmpy2.is_square(b2):
+        b2 += 2 * a + 1
+        a += 1
+        i += 1
+        if i % 4096 == 0 and time.monotonic() > deadline:
+            raise TimeoutError
+    b = gmpy2.isqrt(b2)
+    if a - b == 1:
+        return None
+    return int(a - b), int(a + b)
+
+
+def wiener(n, e, deadline):
+    """
+    Wiener's attack, recovering a small private exponent from the continued fraction of e/n.
+    """
+    num, den = gmpy2.mpz(e), gmpy2.mpz(n)
+    k0, k1, d0, d1 = 0, 1, 1, 0
+    while den:
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        a, rem = gmpy2.f_divmod(num, den)
+        num, den = den, rem
+        k0, k1 = k1, a * k1 + k0
+        d0, d1 = d1, a * d1 + d0
+        # k1/d1 is the next convergent
+        if k1 == 0 or (e * d1 - 1) % k1 != 0:
+            continue
+        phi = (e * d1 - 1) // k1
+        s = n - phi + 1
+        discriminant = s * s - 4 * n
+        if discriminant >= 0 and gmpy2.is_square(discriminant):
+            root = gmpy2.isqrt(discriminant)
+            p, q = (s - root) // 2, (s + root) // 2
+            if p > 1 and p * q == n:
+                return int(p), int(q)
+    return None
+
+
+CHECKS = {
+    "trial": trial_division,
+    "fermat": fermat,
+    "wiener": wiener,
+}
+
+
+def _init_worker(trial_bound):
+    global TRIAL_BOUND
+    TRIAL_BOUND = trial_bound
+
+
+def triage_key(n, e, budgets, checks=None):
+    """
+    Run the given per-key checks (default: all) on a public key, each limited by its time budget in seconds.
+    Returns a dictionary mapping each check to a result: 'ok', 'timeout' or the factors (p, q).
+    """
+    results = {}
+    for name, check in CHECKS.items():
+        if checks is not None and name not in checks:
+            continue
+        try:
+            factors = check(n, e, time.monotonic() + budgets.get(name, DEFAULT_BUDGET))
+        except TimeoutError:
+            results[name] = "timeout"
+            continue
+        results[name] = list(factors) if factors else "ok"
+    return results
+
+
+def key_id(n, e):
+    """
+    Return the identifier of a public key in the cache.
+    """
+    return hashlib.sha256(f"{n}:{e}".encode()).hexdigest()
+
+
+def load_cache(filename):
+    """
+    Load the cached results from a JSON lines file, returning a dictionary mapping key ids to entries
+    with the results and the budgets and trial division bound they were computed with.
+    """
+    cache = {}
+    if filename and os.path.exists(filename):
+        with open(filename, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    cache[entry["id"]] = entry
+    return cache
+
+
+def stale_checks(entry, budgets, trial_bound):
+    """
+    Return the checks of a cache entry that have to be run again: checks without a result, checks that
+    timed out with a smaller budget than requested and trial division with a lower bound than requested.
+    """
+    stale = []
+    for name in CHECKS:
+        result = entry["results"].get(name) if entry else None
+        if isinstance(result, list):
+            continue
+        if (result is None or name == "trial" and entry.get("trial_bound", 0) < trial_bound
+                or result == "timeout" and entry.get("budgets", {}).get(name, 0) < budgets.get(name, DEFAULT_BUDGET)):
+            stale.append(name)
+    return stale
+
+
+def triage(keys, budgets, cache_file=None, jobs=None, trial_bound=TRIAL_BOUND):
+    """
+    Run the per-key checks for all keys (as returned by load_keys) not yet in the cache.
+    Cached checks are run again only with a larger budget (if they timed out) or a higher trial division bound.
+    New results are appended to the cache file as soon as they are available.
+    Returns a dictionary mapping (n, e) to the results.
+    """
+    cache = load_cache(cache_file)
+    results = {}
+    todo = {}
+    for n, entries in keys.items():
+        for e in sorted({e for _, e in entries}):
+            entry = cache.get(key_id(n, e))
+            stale = stale_checks(entry, budgets, trial_bound)
+            if stale:
+                todo[(n, e)] = (entry, stale)
+            else:
+                results[(n, e)] = entry["results"]
+    print(f"Checking {len(todo)} keys ({len(results)} cached)", file=sys.stderr)
+    if not todo:
+        return results
+    cache_out = open(cache_file, "a", encoding="utf-8") if cache_file else None
+    try:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(trial_bound,)) as executor:
+            futures = {executor.submit(triage_key, n, e, budgets, stale): (n, e) for (n, e), (_, stale) in todo.items()}
+            for future in as_completed(futures):
+                n, e = futures[future]
+                entry, stale = todo[(n, e)]
+                # keep the cached results of the checks that were not run again, with their budgets
+                cached = entry or {"results": {}, "budgets": {}, "trial_bound": trial_bound}
+                merged = {**cached["results"], **future.result()}
+                results[(n, e)] = {name: merged[name] for name in CHECKS if name in merged}
+                if cache_out:
+                    cache_out.write(json.dumps({
+                        "id": key_id(n, e),
+                        "trial_bound": trial_bound if "trial" in stale else cached.get("trial_bound", 0),
+                        "budgets": {name: budgets.get(name, DEFAULT_BUDGET) if name in stale
+                                    else cached.get("budgets", {}).get(name, 0) for name in CHECKS},
+                        "results": results[(n, e)],
+                    }) + "\n")
+                    cache_out.flush()
+    finally:
+        if cache_out:
+            cache_out.close()
+    return results
+
+
+def corpus_checks(keys, low_exponent_bound=LOW_EXPONENT_BOUND):
+    """
+    Run the checks spanning multiple keys.
+    Yields (description, key files) tuples for each finding.
+    """
+    by_exponent = {}
+    for n, entries in keys.items():
+        exponents = sorted({e for _, e in entries})
+        for i, e1 in enumerate(exponents):
+            for e2 in exponents[i + 1:]:
+                if gmpy2.gcd(e1, e2) == 1:
+                    files = [f for f, e in entries if e in (e1, e2)]
+                    yield f"common modulus with coprime exponents {e1} and {e2}", files
+        for filename, e in entries:
+            by_exponent.setdefault(e, []).append(filename)
+    for e, files in sorted(by_exponent.items()):
+        if e < low_exponent_bound and len(files) >= e:
+            yield f"low exponent {e} used by {len(files)} keys (broadcast attack possible)", files
+
+
+def parse_budgets(values):
+    """
+    Parse budget arguments of the form SECONDS or CHECK=SECONDS.
+    """
+    budgets = {}
+    for value in values:
+        name, _, seconds = value.rpartition("=")
+        if name and name not in CHECKS:
+            raise ValueError(f"Unknown check {name}")
+        for check in [name] if name else CHECKS:
+            if not name and check in budgets:
+                continue
+            budgets[check] = float(seconds)
+    return budgets
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Triage a corpus of RSA public keys for common weaknesses")
+    argparser.add_argument("keys", nargs="+", help="Files containing RSA public keys in PEM format, or directories with such files (*.pem)")
+    argparser.add_argument("--budget", action="append", default=[], metavar="[CHECK=]SECONDS",
+                           help=f"Time budget per key for all checks or a single check ({', '.join(CHECKS)}), "
+                                f"can be given multiple times, default: {DEFAULT_BUDGET}")
+    argparser.add_argument("--trial-bound", type=int, default=TRIAL_BOUND, help=f"Upper bound for trial division (default: {TRIAL_BOUND})")
+    argparser.add_argument("--cache", metavar="FILE", help="JSON lines file to cache results in, only keys not in the cache are checked")
+    argparser.add_argument("--jobs", "-j", type=int, help="Number of processes (default: number of CPUs)")
+    argparser.add_argument("--output-dir", "-o", metavar="DIR", help="Directory to write the asn1parse configuration of factored private keys to")
+    args = argparser.parse_args()
+
+    try:
+        check_budgets = parse_budgets(args.budget)
+    except ValueError as err:
+        argparser.error(str(err))
+
+    rsa_keys = load_keys(args.keys)
+    key_results = triage(rsa_keys, check_budgets, args.cache, args.jobs, args.trial_bound)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    for modulus, key_entries in rsa_keys.items():
+        for key_file, exponent in key_entries:
+            for check_name, result in key_results[(modulus, exponent)].items():
+                if result == "timeout":
+                    print(f"{key_file}: {check_name} timed out", file=sys.stderr)
+                elif result != "ok":
+                    p, q = result
+                    print(f"{key_file}: factored by {check_name}: p={p} q={q}")
+                    if args.output_dir:
+                        d = int(gmpy2.invert(exponent, (p - 1) * (q - 1)))
+                        conf = os.path.join(args.output_dir, os.path.basename(key_file).removesuffix(".pem") + ".conf")
+                        with open(conf, "w", encoding="utf-8") as f:
+                            f.write(rsa_key_conf(p, q, exponent, d) + "\n")
+    for description, key_files in corpus_checks(rsa_keys):
+        print(f"{', '.join(key_files)}: {description}")
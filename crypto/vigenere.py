@@ -2,11 +2,30 @@
 
 """
 Tool to apply the Vigenère cipher to a text (encryption and decryption).
+
+The crack mode recovers an unknown key from a ciphertext: the key length
+is estimated with the index of coincidence and each column of the key is
+solved like a Caesar cipher from its letter frequencies.
+This requires numpy.
 """
 
 import argparse
+import sys
+
+from caesar import STR_TABLES, ENGLISH_PROFILE, np, score_rotations
+from frequency_analysis import analyse
+
+
+MAX_KEY_LENGTH = 40
+IOC_SAMPLE_SIZE = 1 << 20
 
-from caesar import rot_char
+
+def key_to_counts(key):
+    """
+    Map the characters of the key to rotation counts.
+    """
+
+    return [ord(c) - 65 for c in key.upper()]
 
 
 def crypt(key, text, decrypt=False):
@@ -15,24 +34,167 @@ def crypt(key, text, decrypt=False):
     """
 
     enc_dec_factor = -1 if decrypt else 1
-    key_list = [ord(c) - 65 for c in key.upper()]  # map char in key to rotation count
-    output = ""
+    tables = [STR_TABLES[(count * enc_dec_factor) % 26] for count in key_to_counts(key)]
+    output = []
     key_counter = 0
     for c in text:
         if c.isalpha():
-            output += rot_char(c, key_list[key_counter] * enc_dec_factor)
-            key_counter = (key_counter + 1) % len(key_list)
+            output.append(c.translate(tables[key_counter]))
+            key_counter = (key_counter + 1) % len(tables)
         else:
-            output += c
-    return output
+            output.append(c)
+    return "".join(output)
+
+
+def crypt_bytes(key, data, decrypt=False):
+    """
+    Encrypt or decrypt given bytes with given key using the Vigenère cipher (vectorized).
+
+    Only the ASCII letters A-Z and a-z are rotated and advance the key.
+    """
+
+    enc_dec_factor = -1 if decrypt else 1
+    shifts = np.array(key_to_counts(key), dtype=np.int64) * enc_dec_factor
+    buf = np.frombuffer(data, dtype=np.uint8).copy()
+    lower = buf | 0x20
+    positions = np.flatnonzero((lower >= ord('a')) & (lower <= ord('z')))
+    letters = buf[positions].astype(np.int64)
+    base = np.where(letters >= ord('a'), ord('a'), ord('A'))
+    key_stream = shifts[np.arange(len(positions)) % len(shifts)]
+    buf[positions] = (letters - base + key_stream) % 26 + base
+    return buf.tobytes()
+
+
+def decode_non_ascii(data):
+    """
+    Return the given bytes decoded as UTF-8 if they contain non-ASCII characters, otherwise None.
+
+    Non-ASCII letters advance the key in crypt(), so such text has to be handled as str.
+    """
+
+    if data.isascii():
+        return None
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+def extract_letters(data):
+    """
+    Return the letters of the given bytes or str as a numpy array with one value per key position.
+
+    ASCII letters are mapped to 0-25. In a str, other letters advance the key like in crypt(),
+    they are mapped to 26 and not counted.
+    """
+
+    if isinstance(data, str):
+        return np.array([ord(c.lower()) - ord('a') if c.isascii() else 26 for c in data if c.isalpha()],
+                        dtype=np.uint8)
+    buf = np.frombuffer(data, dtype=np.uint8) | 0x20
+    return buf[(buf >= ord('a')) & (buf <= ord('z'))] - ord('a')
+
+
+def index_of_coincidence(letters, key_length):
+    """
+    Return the average index of coincidence over the columns for a given key length.
+    """
+
+    rows = len(letters) // key_length
+    if rows < 2:
+        return 0.0
+    columns = letters[:rows * key_length].reshape(rows, key_length).T.astype(np.int64)
+    counts = np.bincount((np.arange(key_length)[:, None] * 27 + columns).ravel(), minlength=key_length * 27)
+    # the last value of each column counts the non-ASCII letters, which are skipped
+    counts = counts.reshape(key_length, 27)[:, :26]
+    totals = counts.sum(axis=1)
+    pairs = np.maximum(totals * (totals - 1), 1)
+    return float(np.mean((counts * (counts - 1)).sum(axis=1) / pairs))
+
+
+def estimate_key_lengths(letters, max_length=MAX_KEY_LENGTH):
+    """
+    Return a list of (key_length, ioc) tuples, the most probable key length first.
+
+    Multiples of the real key length have a similar index of coincidence,
+    so the shortest length with an index close to the maximum is preferred.
+    """
+
+    sample = letters[:IOC_SAMPLE_SIZE]
+    iocs = [(length, index_of_coincidence(sample, length)) for length in range(1, max_length + 1)]
+    best = max(ioc for _, ioc in iocs)
+    close = [x for x in iocs if x[1] >= 0.9 * best]
+    rest = sorted((x for x in iocs if x[1] < 0.9 * best), key=lambda x: x[1], reverse=True)
+    return close + rest
+
+
+def solve_key(letters, key_length, metric="chi2"):
+    """
+    Recover the key of given length by solving each column as a Caesar cipher.
+    """
+
+    text = (letters + ord('a')).astype(np.uint8).tobytes().decode("ascii")
+    counts = []
+    for i in range(key_length):
+        frequencies = analyse(text[i::key_length])
+        counts.append([frequencies.get(chr(ord('a') + c), 0) for c in range(26)])
+    scores = score_rotations(np.array(counts, dtype=np.int64), ENGLISH_PROFILE, metric)
+    rotations = np.argmin(scores, axis=1) if metric == "chi2" else np.argmax(scores, axis=1)
+    return "".join(chr(ord('A') + (26 - int(r)) % 26) for r in rotations)
+
+
+def crack(data, key_length=None, candidates=1, max_length=MAX_KEY_LENGTH):
+    """
+    Crack a Vigenère ciphertext given as bytes.
+
+    Returns a list of (key, plaintext) tuples for the most probable key lengths.
+    """
+
+    text = decode_non_ascii(data)
+    letters = extract_letters(data if text is None else text)
+    if key_length:
+        key_lengths = [key_length]
+    else:
+        key_lengths = [length for length, _ in estimate_key_lengths(letters, max_length)[:candidates]]
+    results = []
+    for length in key_lengths:
+        key = solve_key(letters, length)
+        if text is None:
+            results.append((key, crypt_bytes(key, data, decrypt=True)))
+        else:
+            results.append((key, crypt(key, text, decrypt=True).encode("utf-8")))
+    return results
 
 
 if __name__ == "__main__":
 
     argparser = argparse.ArgumentParser(description="Apply Vigenère cipher to a text.")
-    argparser.add_argument("key", help="the key needed for encryption/decryption")
-    argparser.add_argument("text", help="the text to encrypt/decrypt")
+    argparser.add_argument("key", nargs="?", help="the key needed for encryption/decryption")
+    argparser.add_argument("text", nargs="?", help="the text to encrypt/decrypt")
     argparser.add_argument("-d", action='store_true', help="decrypt instead of encrypt")
+    argparser.add_argument("--crack", metavar="FILE", help="recover the key for the ciphertext in a file ('-' for stdin)")
+    argparser.add_argument("--key-length", type=int, help="use this key length in crack mode instead of estimating it")
+    argparser.add_argument("--candidates", type=int, default=1, help="number of key length candidates to try in crack mode (default: 1)")
+    argparser.add_argument("--max-key-length", type=int, default=MAX_KEY_LENGTH, help=f"maximum key length to consider in crack mode (default: {MAX_KEY_LENGTH})")
     args = argparser.parse_args()
 
-    print(crypt(args.key, args.text, args.d))
+    if args.crack:
+        if args.key or args.text:
+            argparser.error("--crack does not take a key or text")
+        if np is None:
+            print("Error: Missing dependency numpy", file=sys.stderr)
+            sys.exit(1)
+        if args.crack == "-":
+            ciphertext = sys.stdin.buffer.read()
+        else:
+            with open(args.crack, "rb") as f:
+                ciphertext = f.read()
+        for recovered_key, plaintext in crack(ciphertext, args.key_length, args.candidates, args.max_key_length):
+            print(f"Key: {recovered_key}")
+            sys.stdout.flush()
+            sys.stdout.buffer.write(plaintext)
+            print()
+    else:
+        if not args.key or args.text is None:
+            argparser.error("the key and text are required")
+        print(crypt(args.key, args.text, args.d))
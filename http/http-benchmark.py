@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+
+"""
+A loopback benchmark for the HTTP tools in this directory.
+
+Starts http-logger.py or websocket-proxy.py on a local port and sends
+requests to it from a configurable number of concurrent clients.
+The websocket proxy is pointed to a simple websocket echo server
+started by the benchmark itself, so no remote endpoint is involved.
+
+Throughput (requests per second) and latency percentiles are reported.
+Results can be appended to a JSON lines file, the new result is then
+compared to the last saved result with the same settings, which makes
+regressions between versions visible.
+
+Arguments after '--' are passed to the tool, e.g.
+
+http-benchmark.py proxy -c 50 -- --multiplex --connections 8
+
+Only successful responses count as requests for the throughput and
+latency, responses with status 400 or higher are counted as errors.
+
+The clients are threads of this process, so for very fast servers the
+benchmark itself may become the bottleneck.
+"""
+
+import argparse
+import base64
+from datetime import datetime, timezone
+import hashlib
+import http.client
+import itertools
+import json
+import os
+import shlex
+import socket
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+import subprocess
+import sys
+import threading
+import time
+
+
+ARGS = None
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+TOOLS = {
+    "logger": "http-logger.py",
+    "proxy": "websocket-proxy.py",
+}
+
+
+def _recv_frame(rfile):
+    header = rfile.read(2)
+    if len(header) < 2:
+        return None, None
+    opcode = header[0] & 0x0f
+    length = header[1] & 0x7f
+    if length == 126:
+        length = int.from_bytes(rfile.read(2), "big")
+    elif length == 127:
+        length = int.from_bytes(rfile.read(8), "big")
+    mask = rfile.read(4) if header[1] & 0x80 else None
+    payload = rfile.read(length)
+    if mask:
+        # unmask all bytes at once instead of byte by byte
+        key = int.from_bytes((mask * (length // 4 + 1))[:length], "big")
+        payload = (int.from_bytes(payload, "big") ^ key).to_bytes(length, "big")
+    return opcode, payload
+
+
+def _send_frame(wfile, opcode, payload):
+    length = len(payload)
+    if length < 126:
+        header = bytes([0x80 | opcode, length])
+    elif length < 65536:
+        header = bytes([0x80 | opcode, 126]) + length.to_bytes(2, "big")
+    else:
+        header = bytes([0x80 | opcode, 127]) + length.to_bytes(8, "big")
+    wfile.write(header + payload)
+    wfile.flush()
+
+
+class EchoWebsocketHandler(StreamRequestHandler):
+    """
+    Minimal websocket server (RFC 6455) sending every message back to the client.
+    """
+
+    def handle(self):
+        key = None
+        while True:
+            line = self.rfile.readline(65537)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"sec-websocket-key":
+                key = value.strip()
+        if key is None:
+            return
+        accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+        self.wfile.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        self.wfile.flush()
+        while True:
+            opcode, payload = _recv_frame(self.rfile)
+            if opcode is None or opcode == 0x8:
+                if opcode == 0x8:
+                    _send_frame(self.wfile, 0x8, payload[:2])
+                return
+            if opcode == 0x9:
+                _send_frame(self.wfile, 0xa, payload)
+            elif opcode in (0x1, 0x2):
+                _send_frame(self.wfile, opcode, payload)
+
+
+class EchoWebsocketServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, process, timeout=10):
+    """
+    Wait until the started tool accepts connections.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Tool exited with code {process.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Tool did not listen on port {port} within {timeout} seconds")
+
+
+def start_tool(tool, port, tool_args, target=None):
+    """
+    Start one of the tools as a subprocess listening on the given port.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), TOOLS[tool])
+    command = [sys.executable, script, "--port", str(port), *tool_args]
+    if target:
+        command.append(target)
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port, process)
+    except RuntimeError:
+        process.kill()
+        raise
+    return process
+
+
+def _client(port, method, path, body, headers, counter, total, deadline, latencies, errors):
+    conn = None
+    while next(counter) < total and time.monotonic() < deadline:
+        if conn is None:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            conn.close()
+            conn = None
+            continue
+        # rejected requests are often much faster and must not inflate the throughput
+        if response.status >= 400:
+            errors.append(1)
+        else:
+            latencies.append(time.perf_counter() - start)
+        if response.will_close:
+            conn.close()
+            conn = None
+    if conn is not None:
+        conn.close()
+
+
+def run_load(port, concurrency, total, duration, method, path, body, headers):
+    """
+    Send total requests (or as many as possible within duration seconds) from concurrent client threads.
+    Returns the latencies of the successful requests, the number of errors and the elapsed time.
+    """
+    counter = itertools.count()
+    deadline = time.monotonic() + duration if duration else float("inf")
+    latencies = []
+    errors = []
+    threads = [threading.Thread(target=_client, args=(port, method, path, body, headers, counter, total,
+                                                      deadline, latencies, errors))
+               for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(errors), time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    """
+    Return the given percentile (nearest rank) of sorted values.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(filename, settings):
+    """
+    Return the last saved result with the same settings, if any.
+    """
+    previous = None
+    if filename and os.path.exists(filename):
+        with open(filename, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    if entry["settings"] == settings:
+                        previous = entry
+    return previous
+
+
+def main():
+    settings = {
+        "tool": ARGS.tool,
+        "tool_args": ARGS.tool_args,
+        "concurrency": ARGS.concurrency,
+        "method": ARGS.method,
+        "path": ARGS.path,
+        "body_size": len(ARGS.body or ""),
+    }
+    body = ARGS.body.encode() if ARGS.body is not None else None
+    headers = {"Content-Type": "application/octet-stream"} if body is not None else {}
+
+    echo_server = None
+    target = None
+    if ARGS.tool == "proxy":
+        echo_server = EchoWebsocketServer(("127.0.0.1", 0), EchoWebsocketHandler)
+        threading.Thread(target=echo_server.serve_forever, daemon=True).start()
+        target = f"ws://127.0.0.1:{echo_server.server_address[1]}/"
+
+    port = ARGS.port or free_port()
+    process = start_tool(ARGS.tool, port, shlex.split(ARGS.tool_args), target)
+    try:
+        if ARGS.warmup:
+            run_load(port, ARGS.concurrency, ARGS.warmup, None, ARGS.method, ARGS.path, body, headers)
+        result = summarize(*run_load(port, ARGS.concurrency, ARGS.requests, ARGS.duration,
+                                     ARGS.method, ARGS.path, body, headers))
+    finally:
+        process.terminate()
+        process.wait()
+        if echo_server:
+            echo_server.shutdown()
+            echo_server.server_close()
+
+    print(f"{ARGS.tool}: {result['requests']} requests in {result['elapsed']} s with concurrency {ARGS.concurrency}, "
+          f"{result['errors']} errors")
+    print(f"  {result['requests_per_second']} requests/s, p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms")
+
+    if ARGS.save:
+        previous = load_previous(ARGS.save, settings)
+        if previous:
+            old = previous["result"]
+            print(f"Compared to {previous['revision'] or 'unknown revision'} from {previous['timestamp']}:")
+            for key in ("requests_per_second", "p50_ms", "p99_ms"):
+                if old[key] and result[key] is not None:
+                    change = (result[key] - old[key]) / old[key] * 100
+                    print(f"  {key}: {old[key]} -> {result[key]} ({change:+.1f}%)")
+        with open(ARGS.save, "a", encoding="utf-8") as f:
+            f.write(json.dumps({
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "revision": git_revision(),
+                "settings": settings,
+                "result": result,
+            }) + "\n")
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Benchmark the HTTP tools on loopback", formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                        epilog="Arguments after -- are passed to the tool, e.g. -- --multiplex -q")
+    argparser.add_argument("tool", choices=TOOLS, help="Tool to benchmark (the proxy is connected to a local websocket echo server)")
+    argparser.add_argument("--concurrency", "-c", type=int, default=10, help="Number of concurrent clients")
+    argparser.add_argument("--requests", "-n", type=int, default=10000, help="Number of requests to send")
+    argparser.add_argument("--duration", "-d", type=float, help="Stop after this many seconds, even if not all requests were sent")
+    argparser.add_argument("--warmup", type=int, default=100, help="Number of requests to send before measuring")
+    argparser.add_argument("--method", "-m", help="HTTP method (default: GET for the logger, POST for the proxy)")
+    argparser.add_argument("--path", default="/", help="Request path")
+    argparser.add_argument("--body", "-b", help="Request body (default: none for the logger, a small JSON message for the proxy)")
+    argparser.add_argument("--port", "-p", type=int, help="Port for the tool to listen on (default: a free port)")
+    argparser.add_argument("--save", "-o", metavar="FILE", help="JSON lines file to append the result to and compare with previous results")
+    # everything after -- is passed to the tool, so its options are not parsed as ours
+    argv = sys.argv[1:]
+    tool_args = []
+    if "--" in argv:
+        argv, tool_args = argv[:argv.index("--")], argv[argv.index("--") + 1:]
+    parsed_args = argparser.parse_args(argv)
+    parsed_args.tool_args = shlex.join(tool_args)
+
+    if parsed_args.method is None:
+        parsed_args.method = "POST" if parsed_args.tool == "proxy" else "GET"
+    if parsed_args.body is None and parsed_args.tool == "proxy":
+        parsed_args.body = '{"id": 1, "message": "ping"}'
+
+    ARGS = parsed_args
+    main()
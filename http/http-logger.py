@@ -7,54 +7,602 @@ Starts an HTTP server and listens to incoming requests.
 Requests are logged to stdout including headers and body.
 
 It is also possible to configure the response code, headers
-and body returned by the server.
+and body returned by the server. Different responses can be returned
+depending on method, path and host with a JSON rules file like:
+
+[
+  {"method": "GET", "path": "/stage1", "redirect": "http://127.0.0.1/stage2"},
+  {"path_regex": "/files/.*\\.xml", "headers": {"Content-Type": "text/xml"}, "body_file": "xxe.xml"},
+  {"host": ".*\\.example\\.com", "status": 404, "body": "not found"}
+]
+
+Rules are tried in order and the first match wins. 'path' matches the
+path without query string exactly, 'path_regex' and 'host' are regular
+expressions matching the whole path (without query string) and host
+name (without port). Unmatched requests get the response given on the
+command line.
 
 A typical use case is analyzing the behavior of a
 server-side request forgery (SSRF) vulnerability.
+
+In concurrent mode, each connection is handled in its own thread and
+HTTP/1.1 keep-alive is supported, so slow or idle clients do not block
+others.
+
+Besides stdout, requests can be logged as structured records (JSON lines
+or SQLite) for later queries. All logging is done by a background thread
+writing in batches, so request handling does not wait for the terminal
+or the disk.
+
+Request bodies may use chunked transfer encoding. Bodies exceeding a
+configurable size are spooled to disk instead of being kept in memory,
+only their hash and a preview are logged.
+
+The last requests can be kept in memory, indexed by client address, path
+and tokens found in the path and header values. Scripts can query them
+from localhost on a reserved path, optionally waiting for a request to
+arrive (long-polling, requires concurrent mode), e.g.
+
+curl 'http://127.0.0.1/_requests?token=f00dcafe1234&wait=30'
+
+returns {"next": ..., "requests": [...]} with the matching requests as
+JSON records. Pass the returned 'next' as 'since' to get the following
+ones, results are paged by 'limit' (oldest first).
 """
 
 import argparse
+import base64
+from collections import deque
+from datetime import datetime, timezone
+import hashlib
+from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, HTTPServer
+import ipaddress
+import json
+import os
+import queue
+import re
 import socket
+from socketserver import ThreadingMixIn
+import sqlite3
 import ssl
 import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
 
 
 ARGS = None
+LOG_WRITER = None
+RULES = None
+STORE = None
+READ_SIZE = 65536
+NO_BODY = {"body": None, "body_size": 0, "body_sha256": None, "body_file": None, "body_preview": None}
 
 
 class HTTPServerV6(HTTPServer):
     address_family = socket.AF_INET6
 
 
+class ThreadingHTTPServerV6(ThreadingMixIn, HTTPServerV6):
+    daemon_threads = True
+    # the default of 5 is too small for many simultaneous callbacks
+    request_queue_size = 128
+
+
+def rotate_file(path):
+    """
+    Rename a log file to the next free path.N name.
+    """
+    i = 1
+    while os.path.exists(f"{path}.{i}"):
+        i += 1
+    os.rename(path, f"{path}.{i}")
+
+
+class TextSink:
+    """
+    Writes requests in human readable form to stdout (and the access log line to stderr).
+    """
+
+    def write(self, records):
+        for record in records:
+            print('='*80)
+            sys.stdout.flush()
+            sys.stderr.write(record["access_log"])
+            sys.stderr.flush()
+            print('-'*80)
+            sys.stdout.write(record["head"])
+            if record["body_file"]:
+                print(f"[{record['body_size']} bytes spooled to {record['body_file']}, sha256 {record['body_sha256']}, preview:]")
+                sys.stdout.flush()
+                sys.stdout.buffer.write(record["body_preview"])
+                sys.stdout.buffer.flush()
+                print()
+            elif record["body"] is not None:
+                sys.stdout.flush()
+                sys.stdout.buffer.write(record["body"])
+                sys.stdout.buffer.flush()
+                print()
+            print()
+        sys.stdout.flush()
+
+    def close(self):
+        pass
+
+
+def json_record(record):
+    """
+    Return the structured fields of a record, with the body (preview) base64-encoded.
+    """
+    fields = {k: v for k, v in record.items() if k not in ("access_log", "head")}
+    for k in ("body", "body_preview"):
+        fields[k] = base64.b64encode(record[k]).decode() if record[k] is not None else None
+    return fields
+
+
+class JsonlSink:
+    """
+    Writes requests as JSON lines to a file, which is rotated when exceeding max_size bytes.
+    """
+
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def write(self, records):
+        self.file.write(''.join(json.dumps(json_record(r)) + '\n' for r in records))
+        self.file.flush()
+        if self.max_size and self.file.tell() >= self.max_size:
+            self.file.close()
+            rotate_file(self.path)
+            self.file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        self.file.close()
+
+
+class SqliteSink:
+    """
+    Writes requests into the table 'requests' of an SQLite database, which is rotated when exceeding max_size bytes.
+    """
+
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        self._connect()
+
+    def _connect(self):
+        # only used from the writer thread
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY, timestamp TEXT, client TEXT, client_port INTEGER, method TEXT,
+            path TEXT, version TEXT, headers TEXT, body BLOB, body_size INTEGER, body_sha256 TEXT,
+            body_file TEXT, status INTEGER)""")
+        self.db.commit()
+
+    def write(self, records):
+        self.db.executemany(
+            "INSERT INTO requests (timestamp, client, client_port, method, path, version, headers, body, "
+            "body_size, body_sha256, body_file, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(r["timestamp"], r["client"], r["client_port"], r["method"], r["path"], r["version"],
+              json.dumps(r["headers"]), r["body"] if r["body"] is not None else r["body_preview"],
+              r["body_size"], r["body_sha256"], r["body_file"], r["status"]) for r in records])
+        self.db.commit()
+        if self.max_size and os.path.getsize(self.path) >= self.max_size:
+            self.db.close()
+            rotate_file(self.path)
+            self._connect()
+
+    def close(self):
+        self.db.close()
+
+
+class LogWriter(threading.Thread):
+    """
+    Background thread passing the logged requests to the sinks in batches.
+    """
+
+    def __init__(self, sinks, batch_size=256, flush_interval=0.5):
+        super().__init__(daemon=True)
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+
+    def log(self, record):
+        self.queue.put(record)
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            # collect more records for a short while to write them in one go
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get(timeout=self.flush_interval if len(batch) == 1 else 0))
+            except queue.Empty:
+                pass
+            if None in batch:
+                running = False
+                batch = batch[:batch.index(None)]
+            if batch:
+                for sink in self.sinks:
+                    sink.write(batch)
+        for sink in self.sinks:
+            sink.close()
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+
+
+def normalize_ip(address):
+    """
+    Return an IPv4 address mapped into IPv6 (as reported by the dual-stack server) in its plain form.
+    """
+    return address.removeprefix("::ffff:")
+
+
+def host_name(host):
+    """
+    Return the host name of a Host header value without the port, IPv6 addresses without brackets.
+    """
+    host = host.strip()
+    if host.startswith("["):
+        return host[1:].partition("]")[0]
+    return host.partition(":")[0] if host.count(":") == 1 else host
+
+
+class RequestStore:
+    """
+    Ring buffer of the last size requests, indexed by client address, path and tokens.
+    Waiting for requests matching a query is supported through a condition variable.
+    """
+
+    FIELDS = ("ip", "path", "token")
+
+    def __init__(self, size, token_regex):
+        self.size = size
+        self.token_re = re.compile(token_regex)
+        # sequence number -> (record, index keys)
+        self.records = {}
+        # (field, value) -> sequence numbers in ascending order
+        self.index = {}
+        self.next_seq = 0
+        self.cond = threading.Condition()
+
+    def keys(self, record):
+        """
+        Return the index keys of a record.
+        """
+        keys = {("ip", normalize_ip(record["client"])), ("path", record["path"].split('?', maxsplit=1)[0])}
+        keys.update(("token", t) for t in self.token_re.findall(record["path"]))
+        for _, value in record["headers"]:
+            keys.update(("token", t) for t in self.token_re.findall(value))
+        return keys
+
+    def add(self, record):
+        keys = self.keys(record)
+        with self.cond:
+            seq = self.next_seq
+            self.next_seq += 1
+            self.records[seq] = (record, keys)
+            for key in keys:
+                self.index.setdefault(key, deque()).append(seq)
+            if len(self.records) > self.size:
+                # the evicted record is the oldest one in each of its index entries
+                _, old_keys = self.records.pop(seq - self.size)
+                for key in old_keys:
+                    seqs = self.index[key]
+                    seqs.popleft()
+                    if not seqs:
+                        del self.index[key]
+            self.cond.notify_all()
+
+    def _find(self, filters, since, limit):
+        if filters:
+            candidates = min((self.index.get(key, ()) for key in filters), key=len)
+        else:
+            candidates = range(self.next_seq - len(self.records), self.next_seq)
+        found = []
+        # newest first, so that only records after since are visited
+        for seq in reversed(candidates):
+            if seq < since:
+                break
+            record, keys = self.records[seq]
+            if all(key in keys for key in filters):
+                found.append((seq, record))
+        return found[::-1]
+
+    def query(self, filters, since=0, limit=100, wait=0):
+        """
+        Return the (sequence number, record) tuples newer than since matching all (field, value) filters,
+        and the sequence number to pass as since for the next query. If more than limit records match, only the
+        oldest ones are returned and the next query continues after them. Waits up to wait seconds for a matching record.
+        """
+        deadline = time.monotonic() + wait
+        with self.cond:
+            while True:
+                found = self._find(filters, since, limit)
+                if len(found) > limit:
+                    found = found[:limit]
+                    return found, found[-1][0] + 1
+                remaining = deadline - time.monotonic()
+                if found or remaining <= 0:
+                    return found, self.next_seq
+                self.cond.wait(remaining)
+
+
+class RequestBody:
+    """
+    Collects a request body in memory up to max_memory bytes, larger bodies are spooled to a file.
+    """
+
+    def __init__(self, max_memory, spool_dir=None, preview_size=256):
+        self.max_memory = max_memory
+        self.spool_dir = spool_dir
+        self.preview_size = preview_size
+        self.data = bytearray()
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.file = None
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        self.sha256.update(chunk)
+        if self.file is None and len(self.data) + len(chunk) > self.max_memory:
+            self.file = tempfile.NamedTemporaryFile(prefix="body-", dir=self.spool_dir, delete=False)
+            self.file.write(self.data)
+            # keep only the preview in memory
+            del self.data[self.preview_size:]
+        if self.file is not None:
+            self.file.write(chunk)
+            if len(self.data) < self.preview_size:
+                self.data += chunk[:self.preview_size - len(self.data)]
+        else:
+            self.data += chunk
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def fields(self):
+        """
+        Return the body related fields of a log record.
+        """
+        spooled = self.file is not None
+        return {
+            "body": None if spooled else bytes(self.data),
+            "body_size": self.size,
+            "body_sha256": self.sha256.hexdigest(),
+            "body_file": self.file.name if spooled else None,
+            "body_preview": bytes(self.data[:self.preview_size]) if spooled else None,
+        }
+
+
+def read_chunked(rfile):
+    """
+    Yield the data of a body with chunked transfer encoding.
+    """
+    while True:
+        line = rfile.readline(65537)
+        try:
+            size = int(line.split(b';', maxsplit=1)[0], 16)
+        except ValueError:
+            raise ValueError("Invalid chunk size") from None
+        if size == 0:
+            break
+        while size > 0:
+            data = rfile.read(min(size, READ_SIZE))
+            if not data:
+                raise ValueError("Incomplete chunk")
+            size -= len(data)
+            yield data
+        rfile.readline(65537)
+    # skip trailers
+    while rfile.readline(65537) not in (b'\r\n', b'\n', b''):
+        pass
+
+
+def read_sized(rfile, size):
+    """
+    Yield the data of a body with the given Content-Length.
+    """
+    while size > 0:
+        data = rfile.read(min(size, READ_SIZE))
+        if not data:
+            raise ValueError("Incomplete body")
+        size -= len(data)
+        yield data
+
+
+class Response:
+    """
+    A response with its headers and body serialized once, only the Date header is added per request.
+    """
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.body = body
+        try:
+            phrase = HTTPStatus(status).phrase
+        except ValueError:
+            phrase = ""
+        self.status_line = f"{status} {phrase}\r\n".encode('latin-1')
+        lines = [f"Server: {BaseHTTPRequestHandler.server_version} {BaseHTTPRequestHandler.sys_version}"]
+        lines += [f"{k}: {v}" for k, v in headers]
+        lines.append(f"Content-Length: {len(body)}")
+        self.head = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+        self.close = any(k.lower() == 'connection' and v.strip().lower() == 'close' for k, v in headers)
+
+    def send(self, handler):
+        handler.log_request(self.status)
+        if self.close:
+            handler.close_connection = True
+        data = [f"{handler.protocol_version} ".encode(), self.status_line, b"Date: ", http_date(), b"\r\n", self.head]
+        if handler.command != 'HEAD':
+            data.append(self.body)
+        handler.wfile.write(b"".join(data))
+
+
+_DATE_CACHE = (0, b"")
+
+
+def http_date():
+    """
+    Return the current date for the Date header, cached per second.
+    """
+    global _DATE_CACHE
+    now = int(time.time())
+    if _DATE_CACHE[0] != now:
+        _DATE_CACHE = (now, BaseHTTPRequestHandler.date_time_string(None, now).encode())
+    return _DATE_CACHE[1]
+
+
+class RuleTable:
+    """
+    Compiled response rules with a dispatch on method and exact path, regex rules are only tried where needed.
+    """
+
+    def __init__(self, rules, default):
+        self.default = default
+        self.exact = {}
+        self.patterns = {}
+        for index, rule in enumerate(rules):
+            response = self._compile_response(rule)
+            host = re.compile(rule["host"], re.IGNORECASE) if "host" in rule else None
+            path_regex = re.compile(rule["path_regex"]) if "path_regex" in rule else None
+            methods = rule.get("method", "*")
+            for method in [methods] if isinstance(methods, str) else methods:
+                method = method.upper()
+                if "path" in rule:
+                    self.exact.setdefault((method, rule["path"]), []).append((index, host, response))
+                else:
+                    self.patterns.setdefault(method, []).append((index, host, path_regex, response))
+
+    @staticmethod
+    def _compile_response(rule):
+        headers = list(rule.get("headers", {}).items())
+        status = rule.get("status", 200)
+        if "redirect" in rule:
+            headers.append(("Location", rule["redirect"]))
+            status = rule.get("status", 302)
+        if "body_file" in rule:
+            with open(rule["body_file"], 'rb') as f:
+                body = f.read()
+        else:
+            body = rule.get("body", "").encode()
+        return Response(status, headers, body)
+
+    def lookup(self, method, target, host):
+        """
+        Return the response of the first rule matching the request, or the default response.
+        """
+        path = target.split('?', maxsplit=1)[0]
+        host = host_name(host)
+        best = None
+        for key in ((method, path), ('*', path)):
+            for index, host_re, response in self.exact.get(key, ()):
+                if (best is None or index < best[0]) and (host_re is None or host_re.fullmatch(host)):
+                    best = (index, response)
+                    break
+        for key in (method, '*'):
+            for index, host_re, path_re, response in self.patterns.get(key, ()):
+                if best is not None and index > best[0]:
+                    break
+                if (path_re is None or path_re.fullmatch(path)) and (host_re is None or host_re.fullmatch(host)):
+                    best = (index, response)
+                    break
+        return best[1] if best else self.default
+
+
 class LoggingHTTPRequestHandler(BaseHTTPRequestHandler):
+    _access_log = None
+
+    def log_message(self, format, *args):
+        # defer the access log line, so that it is written together with the rest of the entry
+        if self._access_log is not None:
+            self._access_log.append(f"{self.address_string()} - - [{self.log_date_time_string()}] {format % args}\n")
+        else:
+            super().log_message(format, *args)
+
+    def _handle_query(self):
+        params = parse_qs(urlsplit(self.path).query)
+        try:
+            filters = [(field, normalize_ip(value) if field == "ip" else value)
+                       for field in RequestStore.FIELDS for value in params.get(field, [])]
+            since = int(params.get("since", [0])[0])
+            limit = int(params.get("limit", [100])[0])
+            if limit < 1:
+                raise ValueError("limit must be at least 1")
+            # long-polling would block the whole server if it is not concurrent
+            wait = min(float(params.get("wait", [0])[0]), ARGS.timeout) if ARGS.concurrent else 0
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        found, next_seq = STORE.query(filters, since, limit, wait)
+        body = json.dumps({
+            "next": next_seq,
+            "requests": [{"id": seq, **json_record(record)} for seq, record in found],
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _is_query(self):
+        return (STORE is not None and self.path.split('?', maxsplit=1)[0] == ARGS.query_path
+                and ipaddress.ip_address(normalize_ip(self.client_address[0])).is_loopback)
+
     def _handle_request(self):
+        timestamp = datetime.now(timezone.utc).isoformat()
         head = f"""{self.requestline}\r\n{self.headers}"""
         size = self.headers['Content-Length']
-        if size:
-            body = self.rfile.read(int(size))
-
-        response_size = 0
-        if ARGS.response_body:
-            response_body = ARGS.response_body.encode()
-            response_size = len(response_body)
-
-        print('='*80)
-        self.send_response(ARGS.response_code)
-        for h in ARGS.response_headers:
-            self.send_header(*h.split(':', maxsplit=1))
-        self.send_header('Content-Length', response_size)
-        self.end_headers()
-        if ARGS.response_body:
-            self.wfile.write(response_body)
-        print('-'*80)
-
-        sys.stdout.write(head)
-        if size:
-            sys.stdout.buffer.write(body)
-            sys.stdout.buffer.flush()
-            print()
-        print()
+        chunked = 'chunked' in self.headers.get('Transfer-Encoding', '').lower()
+        body = None
+        if chunked or size:
+            body = RequestBody(ARGS.max_body_memory, ARGS.spool_dir, ARGS.preview_size)
+            try:
+                for data in read_chunked(self.rfile) if chunked else read_sized(self.rfile, int(size)):
+                    body.write(data)
+            except ValueError as e:
+                self.close_connection = True
+                self.send_error(400, str(e))
+                return
+            finally:
+                body.close()
+
+        if self._is_query():
+            self._handle_query()
+            return
+
+        response = RULES.lookup(self.command, self.path, self.headers.get('Host', ''))
+        self._access_log = []
+        response.send(self)
+        self.wfile.flush()
+
+        record = {
+            "timestamp": timestamp,
+            "client": self.client_address[0],
+            "client_port": self.client_address[1],
+            "method": self.command,
+            "path": self.path,
+            "version": self.request_version,
+            "headers": list(self.headers.items()),
+            **(body.fields() if body else NO_BODY),
+            "status": response.status,
+            "access_log": ''.join(self._access_log),
+            "head": head,
+        }
+        if STORE is not None:
+            STORE.add(record)
+        LOG_WRITER.log(record)
+        self._access_log = None
 
     def do_GET(self):
         self._handle_request()
@@ -85,15 +633,45 @@ class LoggingHTTPRequestHandler(BaseHTTPRequestHandler):
 
 
 def main():
-    with HTTPServerV6(("", ARGS.port), LoggingHTTPRequestHandler) as httpd:
+    global LOG_WRITER, RULES, STORE
+    default = Response(ARGS.response_code, [[s.strip() for s in h.split(":", maxsplit=1)] for h in ARGS.response_headers],
+                       (ARGS.response_body or "").encode())
+    rules = []
+    if ARGS.rules:
+        with open(ARGS.rules, encoding='utf-8') as f:
+            rules = json.load(f)
+    RULES = RuleTable(rules, default)
+    if ARGS.store:
+        STORE = RequestStore(ARGS.store, ARGS.token_regex)
+
+    sinks = [] if ARGS.quiet else [TextSink()]
+    if ARGS.log_file:
+        max_size = int(ARGS.rotate_size * 1024 * 1024) if ARGS.rotate_size else None
+        if ARGS.log_format == "sqlite":
+            sinks.append(SqliteSink(ARGS.log_file, max_size))
+        else:
+            sinks.append(JsonlSink(ARGS.log_file, max_size))
+    LOG_WRITER = LogWriter(sinks)
+    LOG_WRITER.start()
+
+    server_class = HTTPServerV6
+    if ARGS.concurrent:
+        server_class = ThreadingHTTPServerV6
+        LoggingHTTPRequestHandler.protocol_version = "HTTP/1.1"
+        LoggingHTTPRequestHandler.timeout = ARGS.timeout
+    with server_class(("", ARGS.port), LoggingHTTPRequestHandler) as httpd:
         try:
             if ARGS.tls_cert:
                 context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
                 context.load_cert_chain(ARGS.tls_cert, ARGS.tls_key)
-                httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
+                # in concurrent mode, perform the handshake in the connection's thread instead of in accept()
+                httpd.socket = context.wrap_socket(httpd.socket, server_side=True,
+                                                   do_handshake_on_connect=not ARGS.concurrent)
             httpd.serve_forever()
         except KeyboardInterrupt:
             pass
+        finally:
+            LOG_WRITER.close()
 
 
 if __name__ == '__main__':
@@ -104,6 +682,19 @@ if __name__ == '__main__':
     argparser.add_argument('--response-code', '-C', type=int, default=200, help="HTTP response code to return (default: 200)")
     argparser.add_argument('--response-headers', '-H', nargs='*', default=[], help="HTTP response headers to include ('Header:Value' ...)")
     argparser.add_argument('--response-body', '-B', help="HTTP response body to send")
+    argparser.add_argument('--rules', '-R', help="JSON file with response rules matching method, path and host")
+    argparser.add_argument('--concurrent', action='store_true', help="Handle connections in parallel threads and support HTTP/1.1 keep-alive")
+    argparser.add_argument('--timeout', type=float, default=60, help="Timeout in seconds for idle connections in concurrent mode (default: 60)")
+    argparser.add_argument('--log-file', '-o', help="File to log structured request records to")
+    argparser.add_argument('--log-format', choices=["jsonl", "sqlite"], default="jsonl", help="Format of the log file (default: jsonl)")
+    argparser.add_argument('--rotate-size', type=float, metavar="MB", help="Rotate the log file when it exceeds this size")
+    argparser.add_argument('--quiet', '-q', action='store_true', help="Do not log requests to stdout")
+    argparser.add_argument('--max-body-memory', type=int, default=1048576, metavar="BYTES", help="Spool request bodies larger than this to disk (default: 1048576)")
+    argparser.add_argument('--spool-dir', help="Directory for spooled request bodies (default: system temp directory)")
+    argparser.add_argument('--preview-size', type=int, default=256, metavar="BYTES", help="Size of the logged preview of spooled bodies (default: 256)")
+    argparser.add_argument('--store', type=int, metavar="SIZE", help="Keep the last SIZE requests in memory for queries from localhost")
+    argparser.add_argument('--query-path', default="/_requests", help="Reserved path for queries of stored requests (default: /_requests)")
+    argparser.add_argument('--token-regex', default=r"[A-Za-z0-9_-]{8,}", help="Regular expression for tokens indexed in paths and header values (default: '[A-Za-z0-9_-]{8,}')")
     parsed_args = argparser.parse_args()
 
     if (parsed_args.tls_cert and not parsed_args.tls_key) or (parsed_args.tls_key and not parsed_args.tls_cert):
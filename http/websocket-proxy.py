@@ -13,64 +13,826 @@ issues but the desired attack tool only supports sending HTTP requests.
 For authentication, an initial message to be send can be specified as a
 cli argument. If cookies are used for authentication, the header is
 automatically copied from the incoming request to the handshake request.
+
+Websocket connections are kept open and reused for later requests with
+the same cookie, so the handshake and the initial message are only sent
+once per connection. Idle connections are closed after a timeout.
+Use --no-pool to open a new connection for each request instead.
+
+In multiplexed mode (--multiplex), the HTTP server runs on asyncio and
+many concurrent requests share a few websocket connections per cookie.
+Responses are matched to the requests in FIFO order, or by a field of
+JSON messages given with --correlate (e.g. 'id' or 'params.requestId').
+The proxy then replaces the field in each request with a unique value
+and restores the original value in the response, so clients need not
+send unique values themselves. Other messages from the server are
+ignored. Note that the proxy rewrites correlated messages: they are
+parsed and serialized again, so whitespace, escapes, duplicate keys
+and number notation may differ from what the client or server sent.
+
+Client connections are kept alive (HTTP/1.1). By default, only the first
+websocket message received is returned. With --frames, --frame-timeout
+and --terminator, further messages can be collected until the given
+number is reached, no message arrives within the timeout or a message
+matches the terminator pattern. If only --frame-timeout or --terminator
+is given, the number of messages is not limited. They are streamed to
+the client with chunked transfer encoding as they arrive.
+
+If the server sends more messages than collected, they make the pooled
+connection unusable: a connection is only reused after no data arrived
+on it for a grace period (--pool-grace) after the response, otherwise
+it is discarded. Messages arriving even later would still be taken as
+the response to the next request, so use a longer grace period or
+--no-pool for such servers, or 0 for servers sending exactly one
+message per request.
+
+To avoid overloading the target, the number of concurrent websocket
+operations (--max-concurrent) and their rate (--rate, --burst) can be
+limited. Excess requests wait in a bounded queue and are rejected with
+status 503 if it is full or they waited longer than --queue-timeout.
+
+Metrics are served in the Prometheus text format on GET /metrics, and
+can be logged periodically with --metrics-interval. They include the
+durations of the phases of each websocket operation (connect, sending
+the initial message, send, receiving the response), counters of the
+responses, errors and reconnects, and the number of requests in flight.
 """
 
 import argparse
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import re
+import select
 import ssl
 import sys
+import threading
+import time
 
 try:
-    from websocket import create_connection, WebSocketConnectionClosedException
+    from websocket import create_connection, WebSocketConnectionClosedException, WebSocketException
 except ModuleNotFoundError:
     print("Error: Missing dependency websocket-client", file=sys.stderr)
     sys.exit(1)
 
 
 ARGS = None
+POOL = None
+SCHEDULER = None
+METRICS = None
 
 
-class WsProxyHTTPRequestHandler(BaseHTTPRequestHandler):
-    def _send_websocket_message(self, data, cookie):
+class Metrics:
+    """
+    Thread-safe counters and latency histograms, rendered in the Prometheus text format.
+    """
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    PHASES = ("connect", "init", "send", "recv")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, labels) -> value
+        self.counters = {}
+        # (name, labels) -> [count per bucket and +Inf, sum of the observed values]
+        self.histograms = {}
+        self.in_flight = 0
+
+    def count(self, name, labels=""):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + 1
+
+    def error(self, reason):
+        self.count("wsproxy_errors_total", f'reason="{reason}"')
+
+    def observe(self, name, labels, seconds):
+        with self.lock:
+            histogram = self.histograms.setdefault((name, labels), [[0] * (len(self.BUCKETS) + 1), 0.0])
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+                    break
+            else:
+                histogram[0][-1] += 1
+            histogram[1] += seconds
+
+    @contextmanager
+    def timed(self, phase):
+        start = time.perf_counter()
+        yield
+        self.observe("wsproxy_phase_duration_seconds", f'phase="{phase}"', time.perf_counter() - start)
+
+    def track(self, delta):
+        with self.lock:
+            self.in_flight += delta
+
+    def render(self):
+        """
+        Return all metrics in the Prometheus text format.
+        """
+        gauges = {"wsproxy_in_flight_requests": self.in_flight}
+        if SCHEDULER:
+            gauges["wsproxy_queued_requests"] = SCHEDULER.waiting
+        if POOL:
+            gauges["wsproxy_idle_connections"] = sum(len(c) for c in list(POOL.idle.values()))
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), (buckets, total) in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(self.BUCKETS + ("+Inf",), buckets):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                    lines.append(f"{name}_sum{{{labels}}} {total}")
+                    lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        for name, value in gauges.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Return a log line with the most important metrics.
+        """
+        with self.lock:
+            statuses = {labels.split('"')[1]: v for (n, labels), v in sorted(self.counters.items()) if n == "wsproxy_responses_total"}
+            reconnects = self.counters.get(("wsproxy_reconnects_total", ""), 0)
+            phases = []
+            for phase in self.PHASES:
+                buckets, total = self.histograms.get(("wsproxy_phase_duration_seconds", f'phase="{phase}"'), ([0], 0.0))
+                if sum(buckets):
+                    phases.append(f"{phase} {total / sum(buckets) * 1000:.1f} ms")
+        return (f"{sum(statuses.values())} responses ({', '.join(f'{s}: {v}' for s, v in statuses.items()) or 'none'}), "
+                f"{self.in_flight} in flight, {reconnects} reconnects, mean {', '.join(phases) or 'n/a'}")
+
+
+def _log_metrics(interval):
+    while True:
+        time.sleep(interval)
+        sys.stderr.write(f"[{time.strftime('%d/%b/%Y %H:%M:%S')}] Metrics: {METRICS.summary()}\n")
+
+
+class Rejected(Exception):
+    pass
+
+
+class Scheduler:
+    """
+    Admits at most max_concurrent operations at a time, started at no more than rate per second
+    (token bucket holding up to burst tokens). Up to max_queue requests wait for up to queue_timeout seconds.
+    Can be used from threads (acquire) or from an event loop (acquire_async), but not both.
+    """
+
+    def __init__(self, max_concurrent=None, rate=None, burst=None, max_queue=1000, queue_timeout=30):
+        self.max_concurrent = max_concurrent
+        self.rate = rate
+        self.burst = burst or max(1, rate or 0)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.cond = threading.Condition()
+        self.async_cond = None
+
+    def _try_take(self):
+        """
+        Start an operation if possible and return None, otherwise return how long to wait at most before trying again.
+        """
+        if self.max_concurrent and self.active >= self.max_concurrent:
+            # woken up by release()
+            return float("inf")
+        if self.rate:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+        self.active += 1
+        return None
+
+    def _enter_queue(self):
+        if self.waiting >= self.max_queue:
+            raise Rejected("Proxy error: Too many requests waiting for the websocket server.")
+        self.waiting += 1
+        return time.monotonic() + self.queue_timeout
+
+    def _timed_out(self, deadline):
+        if time.monotonic() >= deadline:
+            raise Rejected("Proxy error: Request waited too long for the websocket server.")
+        return deadline - time.monotonic()
+
+    def acquire(self):
+        """
+        Wait until an operation may start, raises Rejected if the queue is full or the wait times out.
+        """
+        with self.cond:
+            delay = self._try_take()
+            if delay is None:
+                return
+            deadline = self._enter_queue()
+            try:
+                while delay is not None:
+                    self.cond.wait(min(delay, self._timed_out(deadline)))
+                    delay = self._try_take()
+            finally:
+                self.waiting -= 1
+
+    async def acquire_async(self):
+        if self.async_cond is None:
+            self.async_cond = asyncio.Condition()
+        async with self.async_cond:
+            delay = self._try_take()
+            if delay is None:
+                return
+            deadline = self._enter_queue()
+            try:
+                while delay is not None:
+                    try:
+                        await asyncio.wait_for(self.async_cond.wait(), min(delay, self._timed_out(deadline)))
+                    except asyncio.TimeoutError:
+                        pass
+                    delay = self._try_take()
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self.cond:
+            self.active -= 1
+            # a single woken waiter may not take the slot (no token yet or timed out), so wake all of them
+            self.cond.notify_all()
+
+    async def release_async(self):
+        async with self.async_cond:
+            self.active -= 1
+            self.async_cond.notify_all()
+
+
+def open_connection(cookie):
+    """
+    Open a websocket connection to the target and send the initial message, if any.
+    """
+    with METRICS.timed("connect"):
         ws = create_connection(ARGS.target, cookie=cookie, **ARGS.connect_args)
-        if ARGS.init_send:
+    METRICS.count("wsproxy_connections_opened_total")
+    if ARGS.init_send:
+        with METRICS.timed("init"):
             ws.send(ARGS.init_send)
             ws.recv()
+    return ws
+
+
+def exchange(ws, data):
+    """
+    Send a message and receive the first message of the response.
+    """
+    with METRICS.timed("send"):
         ws.send(data)
-        response = ws.recv()
+    with METRICS.timed("recv"):
+        return ws.recv()
+
+
+def close_connection(ws):
+    try:
         ws.close()
-        return response
+    except Exception:
+        # the connection is dropped anyway
+        pass
+
+
+def wait_readable(ws, timeout):
+    """
+    Wait up to timeout seconds for data (or the connection being closed) on a connection.
+    Unlike a socket timeout during recv(), this cannot interrupt a partially received frame.
+    """
+    if isinstance(ws.sock, ssl.SSLSocket) and ws.sock.pending():
+        return True
+    try:
+        readable, _, _ = select.select([ws.sock], [], [], timeout)
+    except (OSError, ValueError):
+        return True
+    return bool(readable)
+
+
+def is_healthy(ws, timeout=0):
+    """
+    Check an idle connection, waiting up to timeout seconds for unexpected data.
+    An idle connection must not be readable, otherwise it was closed or has unexpected pending data.
+    """
+    return ws.connected and not wait_readable(ws, timeout)
+
+
+def collect_frames(ws, first):
+    """
+    Yield the first and further received messages as bytes, according to the collection policy.
+    """
+    frame = first
+    count = 1
+    while True:
+        if isinstance(frame, str):
+            frame = frame.encode()
+        yield frame
+        if ARGS.terminator and ARGS.terminator.search(frame):
+            return
+        if ARGS.frames and count >= ARGS.frames:
+            return
+        if ARGS.frame_timeout is not None and not wait_readable(ws, ARGS.frame_timeout):
+            return
+        frame = ws.recv()
+        count += 1
+
+
+class ConnectionPool:
+    """
+    Pool of idle websocket connections, keyed by the cookie used for the handshake.
+    Connections idle for longer than idle_timeout seconds are closed by a background thread.
+    Connections are only reused after grace seconds without data since their release, so that
+    late messages of the previous response are not taken as the response to the next request.
+    """
+
+    def __init__(self, max_idle=16, idle_timeout=60, grace=0.05):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.grace = grace
+        self.lock = threading.Lock()
+        # cookie -> list of (connection, time of release), most recently used last
+        self.idle = {}
+        threading.Thread(target=self._evict_idle, daemon=True).start()
+
+    def acquire(self, cookie):
+        """
+        Return a healthy idle connection for the cookie, or a new one.
+        If no idle connection has completed its grace period, the rest of it is waited for.
+        The second return value tells whether the connection was reused.
+        """
+        while True:
+            with self.lock:
+                connections = self.idle.get(cookie)
+                if not connections:
+                    break
+                # the most recently used connection that has completed its grace period, or else the last one
+                ripe = time.monotonic() - self.grace
+                index = next((i for i in reversed(range(len(connections))) if connections[i][1] <= ripe), -1)
+                ws, released = connections.pop(index)
+            if is_healthy(ws, max(0, released + self.grace - time.monotonic())):
+                return ws, True
+            close_connection(ws)
+        return open_connection(cookie), False
+
+    def release(self, cookie, ws):
+        """
+        Return a connection to the pool after a successful request.
+        """
+        if not ws.connected:
+            return
+        with self.lock:
+            connections = self.idle.setdefault(cookie, [])
+            connections.append((ws, time.monotonic()))
+            dropped = connections.pop(0)[0] if len(connections) > self.max_idle else None
+        if dropped:
+            close_connection(dropped)
+
+    def _evict_idle(self):
+        while True:
+            time.sleep(max(self.idle_timeout / 2, 1))
+            expired = []
+            with self.lock:
+                limit = time.monotonic() - self.idle_timeout
+                for cookie in list(self.idle):
+                    connections = self.idle[cookie]
+                    expired.extend(ws for ws, released in connections if released < limit)
+                    connections[:] = [(ws, released) for ws, released in connections if released >= limit]
+                    if not connections:
+                        del self.idle[cookie]
+            for ws in expired:
+                close_connection(ws)
+
+
+class ProxyHTTPServer(ThreadingHTTPServer):
+    # the default of 5 is too small for tools sending many requests at once
+    request_queue_size = 128
+
+
+class WsProxyHTTPRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, which would wait for delayed ACKs on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def _send_websocket_message(self, data, cookie):
+        """
+        Send a message and receive the first message of the response.
+        Returns the connection, which is to be passed to _finish() afterwards, and the received message.
+        """
+        if POOL is None:
+            ws = open_connection(cookie)
+            try:
+                return ws, exchange(ws, data)
+            except BaseException:
+                close_connection(ws)
+                raise
+
+        ws, reused = POOL.acquire(cookie)
+        try:
+            response = exchange(ws, data)
+        except (WebSocketConnectionClosedException, ConnectionError):
+            close_connection(ws)
+            if not reused:
+                raise
+            # the pooled connection went stale, retry once with a new one
+            METRICS.count("wsproxy_reconnects_total")
+            ws = open_connection(cookie)
+            try:
+                response = exchange(ws, data)
+            except BaseException:
+                close_connection(ws)
+                raise
+        except BaseException:
+            close_connection(ws)
+            raise
+        return ws, response
+
+    def _finish(self, cookie, ws, complete):
+        """
+        Return the connection to the pool, or close it if it is not pooled or the response was not complete.
+        """
+        if POOL is None or not complete:
+            close_connection(ws)
+        else:
+            POOL.release(cookie, ws)
+
+    def _send_body(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-Length', len(body))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_frames(self, frames):
+        self.send_response(200)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, frame in enumerate(frames):
+            if i:
+                frame = ARGS.separator + frame
+            # an empty chunk would end the response
+            if frame:
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(frame), frame))
+                self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_request(self, code='-', size='-'):
+        if code != '-':
+            METRICS.count("wsproxy_responses_total", f'status="{int(code)}"')
+        super().log_request(code, size)
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(501, f"Unsupported method ({self.command!r})")
+            return
+        body = METRICS.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.wfile.write(body)
 
     def do_POST(self):
+        METRICS.track(1)
+        try:
+            self._handle_post()
+        finally:
+            METRICS.track(-1)
+
+    def _handle_post(self):
         size = self.headers['Content-Length']
         if size:
             data = self.rfile.read(int(size))
         else:
-            self.send_response(411)
-            self.end_headers()
-            self.wfile.write(b"Proxy error: Set a Content-Length header and send data in the POST body.")
+            # the end of the request is unknown
+            self.close_connection = True
+            self._send_body(411, b"Proxy error: Set a Content-Length header and send data in the POST body.")
             return
 
-        cookie = self.headers['Cookie']
+        if SCHEDULER is None:
+            self._proxy(data, self.headers['Cookie'])
+            return
+        try:
+            SCHEDULER.acquire()
+        except Rejected as e:
+            METRICS.error("rejected")
+            self._send_body(503, str(e).encode())
+            return
+        try:
+            self._proxy(data, self.headers['Cookie'])
+        finally:
+            SCHEDULER.release()
 
+    def _proxy(self, data, cookie):
         try:
-            ws_response = self._send_websocket_message(data, cookie)
+            ws, ws_response = self._send_websocket_message(data, cookie)
         except WebSocketConnectionClosedException:
-            self.send_response(502)
-            self.end_headers()
-            self.wfile.write(b"Proxy error: Websocket server prematurely closed the connection.")
+            METRICS.error("closed")
+            self._send_body(502, b"Proxy error: Websocket server prematurely closed the connection.")
+            return
+        except (WebSocketException, OSError) as e:
+            METRICS.error("connection")
+            self._send_body(502, f"Proxy error: Websocket connection failed: {e}".encode())
             return
 
-        if isinstance(ws_response, str):
-            ws_response = ws_response.encode()
-        self.send_response(200)
-        self.send_header('Content-Length', len(ws_response))
-        self.end_headers()
-        self.wfile.write(ws_response)
+        complete = False
+        streaming = False
+        try:
+            frames = collect_frames(ws, ws_response)
+            if ARGS.frames == 1:
+                self._send_body(200, next(frames))
+            elif self.request_version == "HTTP/1.0":
+                # no chunked encoding for HTTP/1.0 clients
+                self._send_body(200, ARGS.separator.join(list(frames)))
+            else:
+                streaming = True
+                self._stream_frames(frames)
+            complete = True
+        except (WebSocketConnectionClosedException, ConnectionError):
+            METRICS.error("closed")
+            if streaming:
+                # the response is cut short, the client notices the missing last chunk
+                self.close_connection = True
+            else:
+                self._send_body(502, b"Proxy error: Websocket server prematurely closed the connection.")
+        finally:
+            self._finish(cookie, ws, complete)
+
+
+def get_field(document, path):
+    """
+    Return the value at a dotted path (e.g. 'params.id' or 'items.0') in a JSON document.
+    """
+    for key in path.split("."):
+        document = document[int(key)] if isinstance(document, list) else document[key]
+    return document
+
+
+def set_field(document, path, value):
+    *parents, last = path.split(".")
+    for key in parents:
+        document = document[int(key)] if isinstance(document, list) else document[key]
+    if isinstance(document, list):
+        document[int(last)] = value
+    else:
+        document[last] = value
+
+
+class MultiplexedConnection:
+    """
+    Websocket connection shared by many requests. A reader thread passes the received messages to the event loop,
+    where they are matched to the pending requests by the correlation field or in FIFO order.
+    """
+
+    ids = itertools.count(1)
+
+    def __init__(self, ws, loop, correlate=None):
+        self.ws = ws
+        self.loop = loop
+        self.correlate = correlate
+        # correlation value -> (future, original value), or futures in the order of the sent messages
+        self.pending = {} if correlate else deque()
+        self.closed = False
+        # a single thread, so that messages are sent in the order of the pending futures
+        self.sender = ThreadPoolExecutor(max_workers=1)
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        while True:
+            try:
+                message = self.ws.recv()
+            except Exception:
+                self.loop.call_soon_threadsafe(self.close)
+                return
+            self.loop.call_soon_threadsafe(self._dispatch, message)
+
+    def _dispatch(self, message):
+        if self.correlate:
+            try:
+                document = json.loads(message)
+                future, original = self.pending.pop(get_field(document, self.correlate))
+            except (ValueError, KeyError, IndexError, TypeError):
+                return
+            set_field(document, self.correlate, original)
+            message = json.dumps(document, ensure_ascii=False)
+        elif self.pending:
+            future = self.pending.popleft()
+        else:
+            return
+        if not future.done():
+            future.set_result(message)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        futures = [f for f, _ in self.pending.values()] if self.correlate else self.pending
+        for future in futures:
+            if not future.done():
+                future.set_exception(WebSocketConnectionClosedException("Connection closed"))
+        self.pending.clear()
+        self.sender.shutdown(wait=False)
+        close_connection(self.ws)
+
+    async def request(self, data, timeout):
+        """
+        Send a message and wait for the matching response.
+        """
+        future = self.loop.create_future()
+        if self.correlate:
+            # raises ValueError or a lookup error for messages without the correlation field
+            document = json.loads(data)
+            original = get_field(document, self.correlate)
+            key = next(self.ids)
+            if isinstance(original, str):
+                key = str(key)
+            set_field(document, self.correlate, key)
+            data = json.dumps(document, ensure_ascii=False)
+            self.pending[key] = (future, original)
+        else:
+            self.pending.append(future)
+        start = time.perf_counter()
+        try:
+            await self.loop.run_in_executor(self.sender, self.ws.send, data)
+        except Exception:
+            self.close()
+            raise WebSocketConnectionClosedException("Sending failed") from None
+        sent = time.perf_counter()
+        METRICS.observe("wsproxy_phase_duration_seconds", 'phase="send"', sent - start)
+        try:
+            response = await asyncio.wait_for(future, timeout)
+            METRICS.observe("wsproxy_phase_duration_seconds", 'phase="recv"', time.perf_counter() - sent)
+            return response
+        except asyncio.TimeoutError:
+            if self.correlate:
+                self.pending.pop(key, None)
+            else:
+                # the order of the responses cannot be relied on anymore
+                self.close()
+            raise
+
+
+class MultiplexPool:
+    """
+    Up to size shared websocket connections per cookie, requests are sent over the least busy one.
+    """
+
+    def __init__(self, size, correlate=None):
+        self.size = size
+        self.correlate = correlate
+        self.connections = {}
+        self.locks = {}
+
+    async def get(self, cookie):
+        lock = self.locks.setdefault(cookie, asyncio.Lock())
+        async with lock:
+            connections = [c for c in self.connections.get(cookie, []) if not c.closed]
+            self.connections[cookie] = connections
+            least_busy = min(connections, key=lambda c: len(c.pending), default=None)
+            if least_busy is not None and (not least_busy.pending or len(connections) >= self.size):
+                return least_busy
+            loop = asyncio.get_running_loop()
+            ws = await loop.run_in_executor(None, open_connection, cookie)
+            connection = MultiplexedConnection(ws, loop, self.correlate)
+            connections.append(connection)
+            return connection
+
+
+async def _multiplexed_response(pool, method, path, data, cookie):
+    if method == "GET" and path == "/metrics":
+        return 200, METRICS.render().encode()
+    if method != "POST":
+        return 501, f"Unsupported method ({method})".encode()
+    if data is None:
+        return 411, b"Proxy error: Set a Content-Length header and send data in the POST body."
+    if SCHEDULER is None:
+        return await _multiplexed_proxy(pool, data, cookie)
+    try:
+        await SCHEDULER.acquire_async()
+    except Rejected as e:
+        METRICS.error("rejected")
+        return 503, str(e).encode()
+    try:
+        return await _multiplexed_proxy(pool, data, cookie)
+    finally:
+        await SCHEDULER.release_async()
+
+
+async def _multiplexed_proxy(pool, data, cookie):
+    try:
+        connection = await pool.get(cookie)
+    except (WebSocketException, OSError) as e:
+        METRICS.error("connection")
+        return 502, f"Proxy error: Could not connect to the websocket server: {e}".encode()
+    try:
+        response = await connection.request(data, ARGS.response_timeout)
+    except (ValueError, LookupError, TypeError):
+        METRICS.error("correlation")
+        return 400, f"Proxy error: Send a JSON message with the correlation field {ARGS.correlate}.".encode()
+    except WebSocketConnectionClosedException:
+        METRICS.error("closed")
+        return 502, b"Proxy error: Websocket server prematurely closed the connection."
+    except asyncio.TimeoutError:
+        METRICS.error("timeout")
+        return 504, b"Proxy error: No response from the websocket server in time."
+    if isinstance(response, str):
+        response = response.encode()
+    return 200, response
+
+
+async def _handle_multiplexed_client(pool, reader, writer):
+    client = writer.get_extra_info("peername")[0]
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, _, target = request_line.decode("latin-1").strip().partition(" ")
+            path, _, version = target.rpartition(" ")
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            connection_header = headers.get("connection", "").lower()
+            keep_alive = connection_header == "keep-alive" if version != "HTTP/1.1" else connection_header != "close"
+            size = headers.get("content-length")
+            data = await reader.readexactly(int(size)) if size else None
+            if data is None and (method == "POST" or "transfer-encoding" in headers):
+                # the end of the request is unknown
+                keep_alive = False
+
+            # requests for the metrics are not counted as in flight
+            tracked = method == "POST"
+            METRICS.track(tracked)
+            try:
+                status, body = await _multiplexed_response(pool, method, path, data, headers.get("cookie"))
+            finally:
+                METRICS.track(-tracked)
+            METRICS.count("wsproxy_responses_total", f'status="{status}"')
+            head = [f"HTTP/1.1 {status} {BaseHTTPRequestHandler.responses.get(status, ('',))[0]}",
+                    f"Content-Length: {len(body)}"]
+            if not keep_alive:
+                head.append("Connection: close")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+            sys.stderr.write(f"{client} - - [{time.strftime('%d/%b/%Y %H:%M:%S')}] \"{request_line.decode('latin-1').strip()}\" {status} -\n")
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_multiplexed():
+    pool = MultiplexPool(ARGS.connections, ARGS.correlate)
+    server = await asyncio.start_server(lambda r, w: _handle_multiplexed_client(pool, r, w),
+                                        ARGS.address, ARGS.port, backlog=1024)
+    print(f"Listening on http://{ARGS.address}:{ARGS.port} for incoming requests (multiplexed)...")
+    async with server:
+        await server.serve_forever()
 
 
 def main():
-    with ThreadingHTTPServer((ARGS.address, ARGS.port), WsProxyHTTPRequestHandler) as httpd:
+    global POOL, SCHEDULER, METRICS
+    METRICS = Metrics()
+    if ARGS.metrics_interval:
+        threading.Thread(target=_log_metrics, args=(ARGS.metrics_interval,), daemon=True).start()
+    if ARGS.max_concurrent or ARGS.rate:
+        SCHEDULER = Scheduler(ARGS.max_concurrent, ARGS.rate, ARGS.burst, ARGS.queue_size, ARGS.queue_timeout)
+    if ARGS.multiplex:
+        try:
+            asyncio.run(serve_multiplexed())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if not ARGS.no_pool:
+        POOL = ConnectionPool(ARGS.pool_size, ARGS.idle_timeout, ARGS.pool_grace)
+    WsProxyHTTPRequestHandler.timeout = ARGS.client_timeout
+    with ProxyHTTPServer((ARGS.address, ARGS.port), WsProxyHTTPRequestHandler) as httpd:
         try:
             print(f"Listening on http://{ARGS.address}:{ARGS.port} for incoming requests...")
             httpd.serve_forever()
@@ -85,9 +847,37 @@ if __name__ == "__main__":
     argparser.add_argument('--no-cert-check', action="store_true", default=False, help="Disable TLS certificate checks")
     argparser.add_argument('--upstream-proxy', type=str, help="Upstream proxy URL (supports http, socks4, socks4a, socks5, socks5h)")
     argparser.add_argument('--init-send', type=str, metavar="MESSAGE", help="Initial message to send after each new connection (e.g. authentication)")
+    argparser.add_argument('--no-pool', action="store_true", default=False, help="Open a new websocket connection for each request instead of reusing connections")
+    argparser.add_argument('--pool-size', type=int, default=16, help="Maximum number of idle websocket connections kept per cookie")
+    argparser.add_argument('--idle-timeout', type=float, default=60, help="Seconds after which idle websocket connections are closed")
+    argparser.add_argument('--pool-grace', type=float, default=0.05, metavar="SECONDS", help="Seconds without further messages after a response before a websocket connection is reused (0 for servers sending exactly one message per request)")
+    argparser.add_argument('--client-timeout', type=float, default=60, help="Seconds after which idle HTTP client connections are closed")
+    argparser.add_argument('--frames', type=int, help="Number of websocket messages to return per request, 0 for no limit (default: no limit with --frame-timeout or --terminator, otherwise 1)")
+    argparser.add_argument('--frame-timeout', type=float, metavar="SECONDS", help="Stop collecting websocket messages when no further one arrives within this time")
+    argparser.add_argument('--terminator', metavar="REGEX", help="Stop collecting websocket messages after one matching this pattern")
+    argparser.add_argument('--separator', default="\\n", help="Separator between multiple websocket messages in the response (escape sequences are supported)")
+    argparser.add_argument('--max-concurrent', type=int, help="Maximum number of concurrent websocket operations (default: unlimited)")
+    argparser.add_argument('--rate', type=float, help="Maximum number of websocket operations started per second (default: unlimited)")
+    argparser.add_argument('--burst', type=int, help="Number of operations that may exceed the rate in a burst (default: the rate)")
+    argparser.add_argument('--queue-size', type=int, default=1000, help="Maximum number of requests waiting for the concurrency or rate limit")
+    argparser.add_argument('--queue-timeout', type=float, default=30, help="Seconds a request may wait for the concurrency or rate limit")
+    argparser.add_argument('--metrics-interval', type=float, metavar="SECONDS", help="Log a summary of the metrics periodically (they are always available on GET /metrics)")
+    argparser.add_argument('--multiplex', action="store_true", default=False, help="Serve requests with asyncio and share a few websocket connections between concurrent requests")
+    argparser.add_argument('--connections', type=int, default=4, help="Maximum number of shared websocket connections per cookie in multiplexed mode")
+    argparser.add_argument('--correlate', metavar="PATH", help="Field of JSON messages to match responses to requests by in multiplexed mode, the messages are rewritten (default: FIFO order)")
+    argparser.add_argument('--response-timeout', type=float, default=30, help="Seconds to wait for a response in multiplexed mode")
     argparser.add_argument('target', help="Websocket URL to proxy to")
     parsed_args = argparser.parse_args()
 
+    if parsed_args.multiplex and (parsed_args.frames not in (None, 1) or parsed_args.frame_timeout is not None or parsed_args.terminator):
+        argparser.error("Collecting multiple websocket messages is not supported in multiplexed mode")
+    if parsed_args.frames is None:
+        parsed_args.frames = 0 if parsed_args.frame_timeout is not None or parsed_args.terminator else 1
+    if parsed_args.frames == 0 and parsed_args.frame_timeout is None and parsed_args.terminator is None:
+        argparser.error("--frames 0 requires --frame-timeout or --terminator")
+    parsed_args.terminator = re.compile(parsed_args.terminator.encode()) if parsed_args.terminator else None
+    parsed_args.separator = parsed_args.separator.encode().decode("unicode_escape").encode("latin-1")
+
     parsed_args.connect_args = {}
 
     if parsed_args.no_cert_check:
@@ -6,35 +6,53 @@ Send an email to an SMTP server.
 This script simply allows to submit an email to an SMTP server.
 It supports explicitly setting certain values like the envolope
 fields MAIL FROM and RCPT TO, which can be useful for spoofing attacks.
+
+In bulk mode, one message is sent per row of a CSV file with a header
+line, e.g. for a phishing simulation. The recipient is taken from the
+'email' column, and the subject and content are templates which can
+refer to all columns like $first_name or ${email} ($$ for a literal $).
+Messages are sent over a few persistent SMTP sessions in parallel, which
+are reset (RSET) between messages and reconnected after a number of
+messages or an error.
 """
 
 import argparse
+import csv
 from email.message import EmailMessage
 from email.utils import formatdate
 import mimetypes
 import os
+import queue
 import smtplib
 import ssl
+from string import Template
 import sys
+import threading
 import uuid
 
 
-def send_email(
-    server,
-    port,
-    from_addr,
-    to_addrs,
-    subject,
-    content,
-    content_type="plain",
-    attachments=None,
-    security="starttls",
-    insecure=False,
-    username=None,
-    password=None,
-    envelope_from=None,
-    envelope_to=None
-):
+SKIPPED = "Skipped after an authentication failure"
+
+
+def read_attachments(paths):
+    """
+    Read the attachment files, returning (filename, data, maintype, subtype) tuples.
+    """
+    attachments = []
+    for attachment in paths or []:
+        mime, encoding = mimetypes.guess_type(attachment)
+        if mime is None or encoding is not None:
+            mime = "application/octet-stream"
+        maintype, subtype = mime.split("/", maxsplit=1)
+        with open(attachment, "rb") as f:
+            attachments.append((os.path.basename(attachment), f.read(), maintype, subtype))
+    return attachments
+
+
+def build_message(from_addr, to_addrs, subject, content, content_type="plain", attachments=None):
+    """
+    Build a message with attachments as returned by read_attachments().
+    """
     msg = EmailMessage()
     msg["From"] = from_addr
     msg["To"] = ", ".join(to_addrs)
@@ -43,15 +61,15 @@ def send_email(
     msg["Subject"] = subject
     msg.set_content(content, subtype=content_type)
 
-    if attachments:
-        for attachment in attachments:
-            mime, encoding = mimetypes.guess_type(attachment)
-            if mime is None or encoding is not None:
-                mime = "application/octet-stream"
-            maintype, subtype = mime.split("/", maxsplit=1)
-            with open(attachment, "rb") as f:
-                msg.add_attachment(f.read(), maintype=maintype, subtype=subtype, filename=os.path.basename(attachment))
+    for filename, data, maintype, subtype in attachments or []:
+        msg.add_attachment(data, maintype=maintype, subtype=subtype, filename=filename)
+    return msg
+
 
+def connect(server, port, security="starttls", insecure=False, username=None, password=None):
+    """
+    Connect to an SMTP server with the given connection security and log in, if credentials are given.
+    """
     ssl_context = ssl.create_default_context() if not insecure else None
     if security == "tls":
         smtp = smtplib.SMTP_SSL(server, port=port, context=ssl_context)
@@ -61,19 +79,178 @@ def send_email(
             smtp.starttls(context=ssl_context)
 
     if username and password:
-        smtp.login(username, password)
+        try:
+            smtp.login(username, password)
+        except smtplib.SMTPException:
+            smtp.close()
+            raise
+    return smtp
 
+
+def send_email(
+    server,
+    port,
+    from_addr,
+    to_addrs,
+    subject,
+    content,
+    content_type="plain",
+    attachments=None,
+    security="starttls",
+    insecure=False,
+    username=None,
+    password=None,
+    envelope_from=None,
+    envelope_to=None
+):
+    msg = build_message(from_addr, to_addrs, subject, content, content_type, read_attachments(attachments))
+    smtp = connect(server, port, security, insecure, username, password)
     smtp.send_message(msg, from_addr=envelope_from, to_addrs=envelope_to)
     smtp.quit()
 
 
+class SMTPSession:
+    """
+    Persistent SMTP session for sending many messages.
+    The session is reset (RSET) between messages and reconnected after max_messages messages or on errors.
+    """
+
+    def __init__(self, connect_args, max_messages=100):
+        self.connect_args = connect_args
+        self.max_messages = max_messages
+        self.smtp = None
+        self.sent = 0
+
+    def send(self, msg, from_addr=None, to_addrs=None):
+        if self.smtp is not None and self.sent >= self.max_messages:
+            self.close()
+        for retry in (False, True):
+            try:
+                if self.smtp is None:
+                    self.smtp = connect(*self.connect_args)
+                    self.sent = 0
+                elif self.sent:
+                    self.smtp.rset()
+                self.smtp.send_message(msg, from_addr=from_addr, to_addrs=to_addrs)
+                self.sent += 1
+                return
+            except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError):
+                # the message was rejected, but the session is still usable
+                self.sent += 1
+                raise
+            except smtplib.SMTPAuthenticationError:
+                # retrying with the same credentials is pointless
+                self.abort()
+                raise
+            except (smtplib.SMTPException, OSError):
+                self.abort()
+                if retry:
+                    raise
+
+    def abort(self):
+        if self.smtp is not None:
+            self.smtp.close()
+            self.smtp = None
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.abort()
+
+
+def read_recipients(filename, email_column="email"):
+    """
+    Read the recipients and their fields from a CSV file with a header line.
+    Returns the column names and a list of dictionaries, one per row.
+    Rows with missing or additional fields are rejected, so that no message contains "None".
+    """
+    with open(filename, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        rows = []
+        for row in reader:
+            if None in row or None in row.values():
+                raise ValueError(f"Line {reader.line_num} of {filename} does not have {len(reader.fieldnames)} fields")
+            rows.append(row)
+        columns = reader.fieldnames or []
+    if email_column not in columns:
+        raise ValueError(f"Column {email_column} not found in {filename}")
+    return columns, rows
+
+
+def _bulk_worker(jobs, results, stop, session, from_addr, subject, content, content_type, attachments, envelope_from):
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            email, fields = job
+            if stop.is_set():
+                results.put((email, SKIPPED))
+                continue
+            # every job must produce a result, otherwise send_bulk() waits forever
+            try:
+                msg = build_message(from_addr, [email], subject.substitute(fields), content.substitute(fields),
+                                    content_type, attachments)
+                session.send(msg, from_addr=envelope_from)
+                results.put((email, None))
+            except smtplib.SMTPAuthenticationError as e:
+                stop.set()
+                results.put((email, f"{e.__class__.__name__}: {e}"))
+            except Exception as e:
+                results.put((email, f"{e.__class__.__name__}: {e}"))
+    finally:
+        session.close()
+
+
+def send_bulk(
+    connect_args,
+    from_addr,
+    recipients,
+    subject,
+    content,
+    content_type="plain",
+    attachments=None,
+    envelope_from=None,
+    email_column="email",
+    sessions=2,
+    max_messages=100
+):
+    """
+    Send one message per recipient (dictionaries of fields) over a pool of persistent SMTP sessions.
+    Subject and content are string.Template templates filled with the fields.
+    Yields (email, error) tuples as the messages are sent, error is None on success.
+    After an authentication failure, the remaining messages are not sent and yielded with error SKIPPED.
+    """
+    subject, content = Template(subject), Template(content)
+    attachments = read_attachments(attachments)
+    jobs = queue.Queue()
+    results = queue.Queue()
+    stop = threading.Event()
+    for fields in recipients:
+        jobs.put((fields[email_column], fields))
+    for _ in range(sessions):
+        jobs.put(None)
+    workers = [threading.Thread(target=_bulk_worker, args=(jobs, results, stop, SMTPSession(connect_args, max_messages), from_addr,
+                                                           subject, content, content_type, attachments, envelope_from))
+               for _ in range(sessions)]
+    for worker in workers:
+        worker.start()
+    for _ in range(len(recipients)):
+        yield results.get()
+    for worker in workers:
+        worker.join()
+
+
 def main():
     argparser = argparse.ArgumentParser(description="Send an email to an SMTP server.")
     argparser.add_argument("server", help="SMTP server to connect to (with optional port suffix, default :25)")
 
     addressing_group = argparser.add_argument_group("addressing")
     addressing_group.add_argument("--from", "-f", metavar="ADDR", dest="from_addr", required=True, help="Sender's email address (From header)")
-    addressing_group.add_argument("--to", "-t", metavar="ADDR", dest="to_addrs", required=True, nargs="+", help="Recipients' email addresses (To header)")
+    addressing_group.add_argument("--to", "-t", metavar="ADDR", dest="to_addrs", nargs="+", help="Recipients' email addresses (To header), required unless in bulk mode")
     addressing_group.add_argument("--envelope-from", metavar="ADDR", help="Set different sender's address for envelope (MAIL FROM)")
     addressing_group.add_argument("--envelope-to", metavar="ADDR", nargs="+", help="Set different recipients' addresses for envelope (RCPT TO)")
 
@@ -88,7 +265,19 @@ def main():
     security_group.add_argument("--sec", choices=["none", "starttls", "tls"], default="starttls", help="Connection security (default: starttls)")
     security_group.add_argument("--insecure", action="store_true", help="Disable TLS certificate checks")
 
+    bulk_group = argparser.add_argument_group("bulk mode")
+    bulk_group.add_argument("--bulk", metavar="CSV", help="Send one message per row of a CSV file, with subject and content as templates ($column)")
+    bulk_group.add_argument("--email-column", default="email", help="CSV column with the recipients' email addresses (default: email)")
+    bulk_group.add_argument("--sessions", type=int, default=2, help="Number of SMTP sessions used in parallel (default: 2)")
+    bulk_group.add_argument("--reconnect-after", type=int, default=100, metavar="N", help="Reconnect SMTP sessions after N messages (default: 100)")
+    bulk_group.add_argument("--results", metavar="FILE", help="Write the result per recipient to a CSV file")
+
     args = argparser.parse_args()
+    if args.bulk:
+        if args.to_addrs or args.envelope_to:
+            argparser.error("--to and --envelope-to are taken from the CSV file in bulk mode")
+    elif not args.to_addrs:
+        argparser.error("the following arguments are required: --to/-t")
 
     target = args.server.rsplit(":", maxsplit=1)
     server = target[0]
@@ -107,6 +296,45 @@ def main():
     else:
         username, password = None, None
 
+    if args.bulk:
+        try:
+            columns, recipients = read_recipients(args.bulk, args.email_column)
+            # check the templates for unknown fields before sending anything
+            for template in (args.subject, content):
+                Template(template).substitute({c: "" for c in columns})
+        except (OSError, ValueError, KeyError) as e:
+            argparser.error(f"Invalid bulk input: {e.__class__.__name__}: {e}")
+
+        connect_args = (server, port, args.sec, args.insecure, username, password)
+        failed = 0
+        skipped = 0
+        results_file = open(args.results, "w", newline="", encoding="utf-8") if args.results else None
+        try:
+            results = csv.writer(results_file) if results_file else None
+            if results:
+                results.writerow(["email", "status", "error"])
+            for email, error in send_bulk(connect_args, args.from_addr, recipients, args.subject, content,
+                                          args.content_type, args.attach, args.envelope_from, args.email_column,
+                                          args.sessions, args.reconnect_after):
+                if error == SKIPPED:
+                    skipped += 1
+                    status = "skipped"
+                elif error:
+                    failed += 1
+                    status = "failed"
+                    print(f"{email}: {error}", file=sys.stderr)
+                else:
+                    status = "sent"
+                if results:
+                    results.writerow([email, status, error or ""])
+        finally:
+            if results_file:
+                results_file.close()
+        if skipped:
+            print(f"Stopped after an authentication failure, skipped {skipped} messages", file=sys.stderr)
+        print(f"Sent {len(recipients) - failed - skipped} of {len(recipients)} messages", file=sys.stderr)
+        sys.exit(1 if failed or skipped else 0)
+
     try:
         send_email(
             server,